@@ -1,5 +1,6 @@
 from .env import Env
 from .recorder import Recorder
+from .vector import BatchEnv
 
 try:
   import gym
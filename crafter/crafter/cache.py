@@ -0,0 +1,120 @@
+import contextlib
+import hashlib
+import json
+import os
+import pathlib
+import tempfile
+import time
+
+import numpy as np
+
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+
+
+class WorldCache:
+
+  # Stores world snapshots as memory-mapped .npy files, evicted in least
+  # recently used order, so that processes can share one directory.
+
+  VERSION = 1
+  # Seconds after which temporary files are left over from a crash.
+  STALE = 600
+  LEDGER = 'size.ledger'
+
+  def __init__(self, directory, capacity=2 ** 30):
+    self._directory = pathlib.Path(directory).expanduser()
+    self._directory.mkdir(exist_ok=True, parents=True)
+    self._capacity = capacity
+    # Creates the ledger if it is missing.
+    with self._ledger():
+      pass
+
+  def key(self, seed, area, world_kwargs):
+    content = json.dumps(
+        [self.VERSION, int(seed), [int(x) for x in area], world_kwargs],
+        sort_keys=True, default=str)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+  def get(self, key):
+    path = self._directory / f'{key}.npy'
+    try:
+      record = np.load(path, mmap_mode='r')
+      os.utime(path)
+    except (FileNotFoundError, ValueError):
+      return None
+    return record
+
+  def put(self, key, record):
+    # Write to a temporary file first so that readers never see partial files.
+    with tempfile.NamedTemporaryFile(
+        dir=self._directory, suffix='.tmp', delete=False) as f:
+      np.save(f, record)
+    path = self._directory / f'{key}.npy'
+    with self._ledger() as ledger:
+      total = ledger['total'] + os.path.getsize(f.name) - _size(path)
+      os.replace(f.name, path)
+      if total > self._capacity:
+        total = self._evict()
+      ledger['total'] = total
+
+  @contextlib.contextmanager
+  def _ledger(self):
+    # The ledger file holds the total size of the entries, so that writes do
+    # not have to list the directory. Processes that share the directory lock
+    # it while they change files. Without a ledger, the size is recomputed.
+    with open(self._directory / self.LEDGER, 'a+') as f:
+      if fcntl:
+        fcntl.flock(f, fcntl.LOCK_EX)
+      f.seek(0)
+      text = f.read().strip()
+      ledger = {'total': int(text) if text else None}
+      if ledger['total'] is None:
+        ledger['total'] = self._evict()
+      yield ledger
+      f.seek(0)
+      f.truncate()
+      f.write(str(ledger['total']))
+
+  def _evict(self):
+    # Returns the total size after evicting. Other processes may write or
+    # delete files concurrently, so missing files are skipped. Temporary files
+    # count toward the size and are deleted once they are too old to still be
+    # written, for example after a crash. Evicting down to a fraction of the
+    # capacity leaves room for the next writes before listing the directory
+    # again.
+    entries = []
+    now = time.time()
+    for path in self._directory.glob('*.*'):
+      if path.suffix not in ('.npy', '.tmp'):
+        continue
+      try:
+        stat = path.stat()
+        if path.suffix == '.tmp' and now - stat.st_mtime > self.STALE:
+          path.unlink()
+          continue
+      except FileNotFoundError:
+        continue
+      entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    if total > self._capacity:
+      for _, size, path in sorted(entries):
+        if total <= 0.9 * self._capacity:
+          break
+        if path.suffix != '.npy':
+          continue
+        try:
+          path.unlink()
+        except FileNotFoundError:
+          pass
+        total -= size
+    return total
+
+
+def _size(path):
+  try:
+    return path.stat().st_size
+  except FileNotFoundError:
+    return 0
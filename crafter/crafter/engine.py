@@ -1,10 +1,12 @@
 import collections
 import functools
+import hashlib
+import heapq
 import pathlib
 
 import imageio
 import numpy as np
-from PIL import Image, ImageEnhance
+from PIL import Image
 
 
 class AttrDict(dict):
@@ -21,13 +23,54 @@ class staticproperty:
     return self.function()
 
 
+class field:
+
+  # Object attribute stored in the arrays of the world, or on the object while
+  # it is not in a world.
+
+  def __init__(self, name):
+    self.name = name
+
+  def __get__(self, obj, owner=None):
+    if obj is None:
+      return self
+    if obj._slot is None:
+      return obj.__dict__[self.name]
+    value = obj.world._fields[self.name][obj._slot]
+    return value.copy() if value.ndim else value.item()
+
+  def __set__(self, obj, value):
+    if obj._slot is None:
+      obj.__dict__[self.name] = value
+    else:
+      obj.world._fields[self.name][obj._slot] = value
+
+
 class World:
 
+  # Objects live in slots of parallel arrays, which are reused and compacted,
+  # and are visited in the order in which they were added.
+
+  # The health column does not apply to the player, which keeps its health
+  # in its inventory. Its entry stays 0, so filters on health have to leave
+  # out the player.
+  _FIELDS = {
+      'type': (np.int32, ()),
+      'alive': (bool, ()),
+      'order': (np.int64, ()),
+      'pos': (np.int64, (2,)),
+      'health': (np.int32, ()),
+      'cooldown': (np.int32, ()),
+      'reload': (np.int32, ()),
+      'facing': (np.int64, (2,)),
+  }
+
   def __init__(self, area, materials, chunk_size):
     self.area = area
     self._chunk_size = chunk_size
     self._mat_names = {i: x for i, x in enumerate([None] + materials)}
     self._mat_ids = {x: i for i, x in enumerate([None] + materials)}
+    self._type_ids = {}
     self.reset()
 
   def reset(self, seed=None):
@@ -35,49 +78,147 @@ class World:
     self.daylight = 0.0
     self._chunks = collections.defaultdict(set)
     self._objects = [None]
+    self._free = []
+    self._added = 0
+    self._live = 0
+    self._fields = {
+        name: np.zeros((16,) + shape, dtype)
+        for name, (dtype, shape) in self._FIELDS.items()}
     self._mat_map = np.zeros(self.area, np.uint8)
     self._obj_map = np.zeros(self.area, np.uint32)
 
   @property
   def objects(self):
     # Return a new list so the objects cannot change while being iterated over.
-    return [obj for obj in self._objects if obj]
+    return [self._objects[i] for i in self._slots()]
 
   @property
   def chunks(self):
     return self._chunks.copy()
 
+  @property
+  def occupancy(self):
+    # Number of live objects and number of allocated object slots.
+    return self._live, len(self._objects) - 1
+
+  def select(self, types=None, pos=None, distance=None, area=None):
+    # Objects of the given classes inside the area (xmin, xmax, ymin, ymax) or
+    # within a Manhattan distance of a position, in the order they were added.
+    # Both look up the cells of the object map, so the cost depends on the
+    # size of the area rather than the number of objects.
+    if distance is not None:
+      (x, y), d = pos, distance
+      area = (x - d, x + d + 1, y - d, y + d + 1)
+    slots = self._slots(area)
+    if types is not None:
+      ids = [self._type_ids[cls] for cls in types if cls in self._type_ids]
+      slots = slots[np.isin(self._fields['type'][slots], ids)]
+    if distance is not None:
+      offset = np.abs(self._fields['pos'][slots] - np.asarray(pos))
+      slots = slots[offset.sum(1) <= distance]
+    return [self._objects[i] for i in slots]
+
   def add(self, obj):
     assert hasattr(obj, 'pos')
     obj.pos = np.array(obj.pos)
     assert self._obj_map[tuple(obj.pos)] == 0
-    index = len(self._objects)
-    self._objects.append(obj)
+    if self._free:
+      index = heapq.heappop(self._free)
+      self._objects[index] = obj
+    else:
+      index = len(self._objects)
+      self._objects.append(obj)
+      if index == len(self._fields['alive']):
+        for name, values in self._fields.items():
+          self._fields[name] = np.concatenate([values, np.zeros_like(values)])
+    cls = type(obj)
+    if cls not in self._type_ids:
+      self._type_ids[cls] = len(self._type_ids) + 1
+    self._fields['type'][index] = self._type_ids[cls]
+    self._fields['alive'][index] = True
+    self._fields['order'][index] = self._added
+    self._added += 1
+    self._live += 1
+    for name in _field_names(cls):
+      if name in obj.__dict__:
+        self._fields[name][index] = obj.__dict__.pop(name)
+    obj._slot = index
     self._obj_map[tuple(obj.pos)] = index
     self._chunks[self.chunk_key(obj.pos)].add(obj)
 
   def remove(self, obj):
     if obj.removed:
       return
-    self._objects[self._obj_map[tuple(obj.pos)]] = None
+    index = obj._slot
     self._obj_map[tuple(obj.pos)] = 0
     self._chunks[self.chunk_key(obj.pos)].remove(obj)
+    # Move the fields back into the object, which may still be referenced.
+    for name in _field_names(type(obj)):
+      obj.__dict__[name] = _item(self._fields[name], index)
+    obj._slot = None
+    self._objects[index] = None
+    self._fields['type'][index] = 0
+    self._fields['alive'][index] = False
+    self._live -= 1
+    heapq.heappush(self._free, index)
+    if index == len(self._objects) - 1:
+      while len(self._objects) > 1 and self._objects[-1] is None:
+        self._objects.pop()
+      self._free = [i for i in self._free if i < len(self._objects)]
+      heapq.heapify(self._free)
+    if len(self._objects) > 32 and 2 * self._live < len(self._objects):
+      self._compact()
     obj.removed = True
 
   def move(self, obj, pos):
     if obj.removed:
       return
-    pos = np.array(pos)
-    assert self._obj_map[tuple(pos)] == 0
-    index = self._obj_map[tuple(obj.pos)]
-    self._obj_map[tuple(pos)] = index
-    self._obj_map[tuple(obj.pos)] = 0
-    old_chunk = self.chunk_key(obj.pos)
-    new_chunk = self.chunk_key(pos)
-    if old_chunk != new_chunk:
-      self._chunks[old_chunk].remove(obj)
-      self._chunks[new_chunk].add(obj)
-    obj.pos = pos
+    # Uses plain integers rather than arrays, since mobs move on every step.
+    (x, y), index = (int(pos[0]), int(pos[1])), obj._slot
+    assert self._obj_map[x, y] == 0
+    old = self._fields['pos'][index]
+    ox, oy = int(old[0]), int(old[1])
+    self._obj_map[x, y] = index
+    self._obj_map[ox, oy] = 0
+    csx, csy = self._chunk_size
+    if ox // csx != x // csx or oy // csy != y // csy:
+      self._chunks[self.chunk_key((ox, oy))].remove(obj)
+      self._chunks[self.chunk_key((x, y))].add(obj)
+    old[:] = x, y
+
+  def positions(self, objs):
+    # Positions of the objects as an (N, 2) array, also of removed ones.
+    positions = np.zeros((len(objs), 2), np.int64)
+    slots = [obj._slot for obj in objs]
+    live = [i for i, slot in enumerate(slots) if slot is not None]
+    positions[live] = self._fields['pos'][[slots[i] for i in live]]
+    for i, obj in enumerate(objs):
+      if slots[i] is None:
+        positions[i] = obj.pos
+    return positions
+
+  def _compact(self):
+    # Moves the live objects into the lowest slots, keeping their order.
+    slots = self._slots()
+    index = np.arange(1, len(slots) + 1)
+    for values in self._fields.values():
+      values[index] = values[slots]
+      values[len(slots) + 1:] = 0
+    self._objects = [None] + [self._objects[i] for i in slots]
+    for i, obj in enumerate(self._objects[1:], 1):
+      obj._slot = i
+    x, y = self._fields['pos'][index].T
+    self._obj_map[x, y] = index
+    self._free = []
+
+  def _slots(self, area=None):
+    if area is None:
+      slots = np.flatnonzero(self._fields['alive'][:len(self._objects)])
+    else:
+      xmin, xmax, ymin, ymax = (max(0, int(x)) for x in area)
+      slots = self._obj_map[xmin: xmax, ymin: ymax]
+      slots = slots[slots > 0].astype(np.intp)
+    return slots[np.argsort(self._fields['order'][slots], kind='stable')]
 
   def __setitem__(self, pos, material):
     if material not in self._mat_ids:
@@ -119,32 +260,93 @@ class World:
 
 class Textures:
 
+  # Assets load from the bundle file unless the PNG files changed, and are
+  # resized into one shared atlas per unit size.
+
+  BUNDLE = 'bundle.npy'
+
+  _atlases = {}
+
   def __init__(self, directory):
-    self._originals = {}
-    self._textures = {}
-    for filename in pathlib.Path(directory).glob('*.png'):
-      image = imageio.imread(filename.read_bytes())
-      image = image.transpose((1, 0) + tuple(range(2, len(image.shape))))
-      self._originals[filename.stem] = image
-      self._textures[(filename.stem, image.shape[:2])] = image
+    self._directory = str(pathlib.Path(directory).resolve())
+    self._originals = _load_textures(self._directory)
+    self.index = {name: i for i, name in enumerate(self._originals)}
+
+  @classmethod
+  def write_bundle(cls, directory):
+    # Rebuilds the bundle file after the assets changed.
+    directory = pathlib.Path(directory)
+    images = _decode_textures(directory)
+    sizes = [image.size for image in images.values()]
+    record = np.zeros((), [
+        ('digest', 'U40'),
+        ('names', 'U64', (len(images),)),
+        ('shapes', np.int32, (len(images), 3)),
+        ('offsets', np.int64, (len(images),)),
+        ('pixels', np.uint8, (sum(sizes),))])
+    record['digest'] = _digest(directory)
+    record['names'] = list(images)
+    record['shapes'] = [image.shape for image in images.values()]
+    record['offsets'] = np.cumsum([0] + sizes[:-1])
+    record['pixels'] = np.concatenate([
+        image.ravel() for image in images.values()])
+    np.save(directory / cls.BUNDLE, record)
 
   def get(self, name, size):
-    if name is None:
-      name = 'unknown'
+    atlas = self.atlas(size)
+    return atlas.rgba[atlas.index['unknown' if name is None else name]]
+
+  def premultiplied(self, name, size):
+    # The color premultiplied by the alpha and the inverse alpha, both scaled
+    # to 255, for _draw_alpha().
+    atlas = self.atlas(size)
+    index = atlas.index['unknown' if name is None else name]
+    return atlas.premultiplied[index], atlas.inverse[index]
+
+  def atlas(self, size):
     size = int(size[0]), int(size[1])
-    key = name, size
-    if key not in self._textures:
-      image = self._originals[name]
-      image = Image.fromarray(image)
-      image = image.resize(size[::-1], resample=Image.NEAREST)
-      image = np.array(image)
-      self._textures[key] = image
-    return self._textures[key]
+    key = self._directory, size
+    if key not in self._atlases:
+      rgba = np.stack([
+          np.array(Image.fromarray(image).resize(size[::-1], resample=Image.NEAREST))
+          for image in self._originals.values()])
+      alpha = rgba[..., 3:].astype(np.uint16)
+      self._atlases[key] = AttrDict(
+          index=self.index,
+          rgba=rgba,
+          premultiplied=rgba[..., :3] * alpha,
+          inverse=255 - alpha)
+    return self._atlases[key]
 
 
 class GlobalView:
 
-  pass
+  # Draws the whole world without lighting, one tile of the unit size per cell.
+
+  def __init__(self, world, textures):
+    self._world = world
+    self._textures = textures
+    self._atlases = {}
+
+  def __call__(self, unit=1):
+    unit = tuple(int(x) for x in np.broadcast_to(unit, 2))
+    (w, h), (u, v) = self._world.area, unit
+    key = unit, len(self._world._mat_ids)
+    if key not in self._atlases:
+      self._atlases[key] = _material_atlas(self._world, self._textures, unit)
+    canvas = np.empty((w * u, h * v, 3), np.uint8)
+    tiles = canvas.reshape((w, u, h, v, 3))
+    tiles[:] = self._atlases[key][self._world._mat_map].transpose((0, 2, 1, 3, 4))
+    slots = self._world._slots()
+    if len(slots):
+      sprites = self._textures.atlas(unit)
+      index = np.array([
+          sprites.index[self._world._objects[slot].texture] for slot in slots])
+      xs, ys = self._world._fields['pos'][slots].T
+      current = tiles[xs, :, ys]
+      tiles[xs, :, ys] = (
+          sprites.premultiplied[index] + sprites.inverse[index] * current) // 255
+    return canvas
 
 
 class UncoverView:
@@ -161,90 +363,170 @@ class LocalView:
     self._offset = self._grid // 2
     self._area = np.array(self._world.area)
     self._center = None
-
-  def __call__(self, player, unit):
-    self._unit = np.array(unit)
+    self._atlases = {}
+    self._previous = {}
+
+  def __call__(self, player, unit, out=None):
+    # Writes the view into out when it is given, which can be a strided view
+    # of a larger array, and returns it.
+    return self.draw(player, [unit], [out])[0]
+
+  def draw(self, player, units, outs=None):
+    # Draws the view for each unit size from the same cells, so the world is
+    # only looked up once. The views are lit in order and each draws its own
+    # noise at night, like separate calls.
     self._center = np.array(player.pos)
-    canvas = np.zeros(tuple(self._grid * unit) + (3,), np.uint8) + 127
-    for x in range(self._grid[0]):
-      for y in range(self._grid[1]):
-        pos = self._center + np.array([x, y]) - self._offset
-        if not _inside((0, 0), pos, self._area):
-          continue
-        texture = self._textures.get(self._world[pos][0], unit)
-        _draw(canvas, np.array([x, y]) * unit, texture)
-    for obj in self._world.objects:
-      pos = obj.pos - self._center + self._offset
-      if not _inside((0, 0), pos, self._grid):
-        continue
-      texture = self._textures.get(obj.texture, unit)
-      _draw_alpha(canvas, pos * unit, texture)
-    canvas = self._light(canvas, self._world.daylight)
-    if player.sleeping:
-      canvas = self._sleep(canvas)
-    # if player.health < 1:
-    #   canvas = self._tint(canvas, (128, 0, 0), 0.6)
+    cells = self._cells()
+    views = []
+    for unit, out in zip(units, outs or [None] * len(units)):
+      self._unit = np.array(unit)
+      drawn = self._draw(tuple(int(x) for x in unit), cells)
+      canvas = self._light(drawn, self._world.daylight)
+      if player.sleeping:
+        canvas = self._sleep(canvas)
+      if out is not None:
+        out[...] = canvas
+        views.append(out)
+      else:
+        views.append(canvas.copy() if canvas is drawn else canvas)
+    return views
+
+  def _cells(self):
+    # The material id and the object texture index of every cell, where cells
+    # outside of the world have material -1 and cells without objects have
+    # texture -1. Texture indices are the same in the atlases of all sizes.
+    (xmin, ymin), (xmax, ymax) = (
+        self._center - self._offset, self._center - self._offset + self._grid)
+    index = self._textures.index
+    window = np.full(self._grid, -1)
+    x0, y0 = max(xmin, 0), max(ymin, 0)
+    x1, y1 = min(xmax, self._area[0]), min(ymax, self._area[1])
+    if x0 < x1 and y0 < y1:
+      window[x0 - xmin: x1 - xmin, y0 - ymin: y1 - ymin] = (
+          self._world._mat_map[x0: x1, y0: y1])
+    textures = np.full(self._grid, -1)
+    slots = self._world._slots((xmin, xmax, ymin, ymax))
+    positions = self._world._fields['pos'][slots] - self._center + self._offset
+    for slot, (x, y) in zip(slots, positions):
+      textures[x, y] = index[self._world._objects[slot].texture]
+    return np.stack([window, textures], -1)
+
+  def _draw(self, unit, cells):
+    # Draws the view before lighting. The canvas of the previous call with the
+    # same unit is scrolled by how far the player moved, and only the cells
+    # whose material or object texture differs from what the canvas shows are
+    # drawn again. Cells outside of the world use the last tile of the atlas.
+    atlas = self._atlas(unit)
+    sprites = self._textures.atlas(unit)
+    window, textures = cells[..., 0], cells[..., 1]
+    if unit in self._previous:
+      center, drawn, canvas = self._previous[unit]
+      shift = self._center - center
+      _scroll(canvas, shift * unit)
+      _scroll(drawn, shift, -2)
+      dirty = (drawn != cells).any(-1)
+    else:
+      canvas = np.empty(tuple(self._grid * unit) + (3,), np.uint8)
+      dirty = np.ones(self._grid, bool)
+    xs, ys = np.nonzero(dirty)
+    tiles = canvas.reshape((self._grid[0], unit[0], self._grid[1], unit[1], 3))
+    tiles[xs, :, ys] = atlas[window[xs, ys]]
+    for x, y in zip(xs, ys):
+      if textures[x, y] >= 0:
+        texture = sprites.premultiplied[textures[x, y]], sprites.inverse[textures[x, y]]
+        _draw_alpha(canvas, (x * unit[0], y * unit[1]), texture)
+    self._previous[unit] = self._center, cells.copy(), canvas
     return canvas
 
+  def _atlas(self, unit):
+    # Materials can be added to the world after the atlas was built.
+    key = unit, len(self._world._mat_ids)
+    if key not in self._atlases:
+      self._atlases[key] = _material_atlas(self._world, self._textures, unit)
+    return self._atlases[key]
+
   def _light(self, canvas, daylight):
+    # Blends the canvas with a noisy, desaturated and tinted version of itself
+    # in fixed point, with the daylight quantized to 256 levels.
+    day = int(round(256 * daylight))
+    if day >= 256:
+      return canvas
     night = canvas
     if daylight < 0.5:
       night = self._noise(night, 2 * (0.5 - daylight), 0.5)
-    night = np.array(ImageEnhance.Color(
-        Image.fromarray(night.astype(np.uint8))).enhance(0.4))
-    night = self._tint(night, (0, 16, 64), 0.5)
-    return daylight * canvas + (1 - daylight) * night
+    night = (_desaturate(night, 0.4) + np.array((0, 16, 64), np.uint16)) >> 1
+    canvas = canvas.astype(np.uint16) * day + night * (256 - day)
+    return (canvas >> 8).astype(np.uint8)
 
   def _sleep(self, canvas):
-    canvas = np.array(ImageEnhance.Color(
-        Image.fromarray(canvas.astype(np.uint8))).enhance(0.0))
-    canvas = self._tint(canvas, (0, 0, 16), 0.5)
-    return canvas
-
-  def _tint(self, canvas, color, amount):
-    color = np.array(color)
-    return (1 - amount) * canvas + amount * color
+    canvas = _desaturate(canvas, 0.0) + np.array((0, 0, 16), np.uint16)
+    return (canvas >> 1).astype(np.uint8)
 
   def _noise(self, canvas, amount, stddev):
-    noise = self._world.random.uniform(32, 127, canvas.shape[:2])[..., None]
-    mask = amount * self._vignette(canvas.shape, stddev)[..., None]
-    return (1 - mask) * canvas + mask * noise
+    # The noise is drawn as before to keep the random state of the world the
+    # same, but mixed in with 8 fractional bits.
+    noise = self._world.random.uniform(32, 127, canvas.shape[:2]).astype(np.uint16)
+    mask = (int(round(256 * amount)) * self._vignette(canvas.shape, stddev)) >> 8
+    mask, noise = mask[..., None], noise[..., None]
+    return ((canvas * (256 - mask) + noise * mask) >> 8).astype(np.uint8)
 
   @functools.lru_cache(10)
   def _vignette(self, shape, stddev):
     xs, ys = np.meshgrid(
         np.linspace(-1, 1, shape[0]),
         np.linspace(-1, 1, shape[1]))
-    return 1 - np.exp(-0.5 * (xs ** 2 + ys ** 2) / (stddev ** 2)).T
+    vignette = 1 - np.exp(-0.5 * (xs ** 2 + ys ** 2) / (stddev ** 2)).T
+    return np.round(256 * vignette).astype(np.uint16)
 
 
 class ItemView:
 
+  # Caches the cells per item, amount and unit, and the last few panels.
+
   def __init__(self, textures, grid):
     self._textures = textures
     self._grid = np.array(grid)
+    self._cells = {}
+    self._panels = collections.OrderedDict()
 
   def __call__(self, inventory, unit):
     unit = np.array(unit)
+    key = tuple(inventory.items()), tuple(unit.tolist())
+    if key in self._panels:
+      self._panels.move_to_end(key)
+      return self._panels[key]
     canvas = np.zeros(tuple(self._grid * unit) + (3,), np.uint8)
     for index, (item, amount) in enumerate(inventory.items()):
       if amount < 1:
         continue
-      self._item(canvas, index, item, unit)
-      self._amount(canvas, index, amount, unit)
+      x, y = (index % self._grid[0], index // self._grid[0]) * unit
+      canvas[x: x + unit[0], y: y + unit[1]] = self._cell(item, amount, unit)
+    canvas.setflags(write=False)
+    self._panels[key] = canvas
+    if len(self._panels) > 32:
+      self._panels.popitem(last=False)
     return canvas
 
+  def _cell(self, item, amount, unit):
+    key = item, amount, tuple(unit.tolist())
+    if key not in self._cells:
+      cell = np.zeros(tuple(unit) + (3,), np.uint8)
+      self._item(cell, 0, item, unit)
+      self._amount(cell, 0, amount, unit)
+      self._cells[key] = cell
+    return self._cells[key]
+
   def _item(self, canvas, index, item, unit):
     pos = index % self._grid[0], index // self._grid[0]
     pos = (pos * unit + 0.1 * unit).astype(np.int32)
-    texture = self._textures.get(item, 0.8 * unit)
+    texture = self._textures.premultiplied(item, 0.8 * unit)
     _draw_alpha(canvas, pos, texture)
 
   def _amount(self, canvas, index, amount, unit):
     pos = index % self._grid[0], index // self._grid[0]
     pos = (pos * unit + 0.4 * unit).astype(np.int32)
     text = str(amount) if amount in list(range(10)) else 'unknown'
-    texture = self._textures.get(text, 0.6 * unit)
+    texture = self._textures.premultiplied(text, 0.6 * unit)
     _draw_alpha(canvas, pos, texture)
 
 
@@ -259,26 +541,132 @@ class SemanticView:
 
   def __call__(self):
     canvas = self._world._mat_map.copy()
-    for obj in self._world.objects:
-      canvas[tuple(obj.pos)] = self._obj_ids[type(obj)]
+    self._draw_objects(canvas, self._world._slots(), (0, 0))
+    return canvas
+
+  def window(self, center, grid):
+    # Only the cells of a view of the grid size around the center. Cells
+    # outside of the world are zero.
+    xmin, ymin = np.array(center) - np.array(grid) // 2
+    xmax, ymax = xmin + grid[0], ymin + grid[1]
+    canvas = np.zeros(tuple(grid), self._world._mat_map.dtype)
+    x0, y0 = max(xmin, 0), max(ymin, 0)
+    x1, y1 = min(xmax, self._world.area[0]), min(ymax, self._world.area[1])
+    if x0 < x1 and y0 < y1:
+      canvas[x0 - xmin: x1 - xmin, y0 - ymin: y1 - ymin] = (
+          self._world._mat_map[x0: x1, y0: y1])
+    slots = self._world._slots((xmin, xmax, ymin, ymax))
+    self._draw_objects(canvas, slots, (xmin, ymin))
     return canvas
 
+  def _draw_objects(self, canvas, slots, offset):
+    ids = np.zeros(len(self._world._type_ids) + 1, canvas.dtype)
+    for cls, type_id in self._world._type_ids.items():
+      ids[type_id] = self._obj_ids.get(cls, 0)
+    values = ids[self._world._fields['type'][slots]]
+    x, y = (self._world._fields['pos'][slots[values > 0]] - offset).T
+    canvas[x, y] = values[values > 0]
+
+
+def _material_atlas(world, textures, unit):
+  # The tiles of the materials by their ids in the world, followed by a gray
+  # tile for cells outside of the world.
+  names = {i: x for x, i in world._mat_ids.items()}
+  tiles = [textures.get(names[i], unit)[..., :3] for i in range(len(names))]
+  tiles.append(np.full(unit + (3,), 127, np.uint8))
+  return np.stack(tiles)
+
+
+def _item(values, index):
+  value = values[index]
+  return value.copy() if value.ndim else value.item()
+
+
+@functools.lru_cache(None)
+def _field_names(cls):
+  return tuple(
+      value.name for value in (getattr(cls, name) for name in dir(cls))
+      if isinstance(value, field))
+
+
+def _desaturate(canvas, factor):
+  # Like ImageEnhance.Color, with the luma weights of PIL and 8 fractional bits
+  # for the factor. Returns uint16 values up to 255.
+  r, g, b = (canvas[..., i].astype(np.uint32) for i in range(3))
+  luma = (19595 * r + 38470 * g + 7471 * b + (1 << 15)) >> 16
+  luma = luma.astype(np.uint16)[..., None]
+  keep = int(round(256 * factor))
+  if not keep:
+    return np.broadcast_to(luma, canvas.shape)
+  return (luma * (256 - keep) + canvas.astype(np.uint16) * keep) >> 8
+
+
+def _scroll(array, shift, fill=None):
+  # Moves the content along the first two axes by -shift in place, so that
+  # the array shows a window that was moved by shift. The uncovered part is
+  # set to the fill value or keeps stale values.
+  (dx, dy), (w, h) = shift, array.shape[:2]
+  if abs(dx) >= w or abs(dy) >= h:
+    if fill is not None:
+      array[:] = fill
+    return
+  array[max(-dx, 0): w - max(dx, 0), max(-dy, 0): h - max(dy, 0)] = (
+      array[max(dx, 0): w - max(-dx, 0), max(dy, 0): h - max(-dy, 0)])
+  if fill is not None:
+    array[:max(-dx, 0)] = array[w - max(dx, 0):] = fill
+    array[:, :max(-dy, 0)] = array[:, h - max(dy, 0):] = fill
+
 
 def _inside(lhs, mid, rhs):
   return (lhs[0] <= mid[0] < rhs[0]) and (lhs[1] <= mid[1] < rhs[1])
 
-def _draw(canvas, pos, texture):
-  (x, y), (w, h) = pos, texture.shape[:2]
-  if texture.shape[-1] == 4:
-    texture = texture[..., :3]
-  canvas[x: x + w, y: y + h] = texture
+
+@functools.lru_cache(None)
+def _load_textures(directory):
+  directory = pathlib.Path(directory)
+  names = [path.stem for path in sorted(directory.glob('*.png'))]
+  try:
+    record = np.load(directory / Textures.BUNDLE, mmap_mode='r')
+    digest = str(record['digest'])
+  except (FileNotFoundError, ValueError):
+    return _decode_textures(directory)
+  # The bundle is out of date when any of the PNG files changed.
+  if record['names'].tolist() != names or digest != _digest(directory):
+    return _decode_textures(directory)
+  pixels = record['pixels']
+  images = {}
+  for name, shape, offset in zip(
+      names, record['shapes'].tolist(), record['offsets'].tolist()):
+    images[name] = pixels[offset: offset + int(np.prod(shape))].reshape(shape)
+  return images
+
+
+def _digest(directory):
+  # Hash of the names and contents of the PNG files. Reading them is fast
+  # compared to decoding them.
+  digest = hashlib.sha1()
+  for filename in sorted(pathlib.Path(directory).glob('*.png')):
+    digest.update(filename.name.encode('utf-8') + b'\0')
+    digest.update(filename.read_bytes())
+  return digest.hexdigest()
+
+
+def _decode_textures(directory):
+  images = {}
+  for filename in sorted(pathlib.Path(directory).glob('*.png')):
+    image = imageio.imread(filename.read_bytes())
+    image = image.transpose((1, 0) + tuple(range(2, len(image.shape))))
+    if image.shape[-1] == 3:
+      image = np.concatenate([image, np.full(image.shape[:2] + (1,), 255, np.uint8)], -1)
+    image.setflags(write=False)
+    images[filename.stem] = image
+  return images
+
 
 def _draw_alpha(canvas, pos, texture):
-  (x, y), (w, h) = pos, texture.shape[:2]
-  if texture.shape[-1] == 4:
-    alpha = texture[..., 3:].astype(np.float32) / 255
-    texture = texture[..., :3].astype(np.float32) / 255
-    current = canvas[x: x + w, y: y + h].astype(np.float32) / 255
-    blended = alpha * texture + (1 - alpha) * current
-    texture = (255 * blended).astype(np.uint8)
-  canvas[x: x + w, y: y + h] = texture
+  # Takes the premultiplied texture and its inverse alpha. The blended values
+  # are at most 255 * 255, so they fit into 16 bits.
+  (x, y), (premultiplied, inverse) = pos, texture
+  w, h = premultiplied.shape[:2]
+  current = canvas[x: x + w, y: y + h]
+  canvas[x: x + w, y: y + h] = (premultiplied + inverse * current) // 255
@@ -1,7 +1,11 @@
 import collections
+import concurrent.futures
+import copy
+import pathlib
 
 import numpy as np
 
+from . import cache
 from . import constants
 from . import engine
 from . import objects
@@ -23,9 +27,14 @@ except ImportError:
 	BaseClass = object
 
 
+INFO_KEYS = (
+	'inventory', 'achievements', 'discount', 'semantic', 'player_pos',
+	'reward', 'episode')
+
+
 class Env(BaseClass):
 
-	def __init__(self, area=(64, 64), view=(9, 9), size=(64, 64), reward=True, length=10000, seed=None, initial_inventory=None, world_kwargs=None, out_type="dict"):
+	def __init__(self, area=(64, 64), view=(9, 9), size=(64, 64), reward=True, length=10000, seed=None, initial_inventory=None, world_kwargs=None, out_type="dict", world_cache=None, prefetch=False, lazy=False, info_keys=None):
 		# print(seed)
 		view = np.array(view if hasattr(view, '__len__') else (view, view))
 		size = np.array(size if hasattr(size, '__len__') else (size, size))
@@ -40,13 +49,33 @@ class Env(BaseClass):
 		self._world = engine.World(area, constants.materials, (12, 12))
 		self._textures = engine.Textures(constants.root / 'assets')
 		item_rows = int(np.ceil(len(constants.items) / view[0]))
+		self._local_grid = np.array([view[0], view[1] - item_rows])
 		self._local_view = engine.LocalView(
-				self._world, self._textures, [view[0], view[1] - item_rows])
+				self._world, self._textures, self._local_grid)
 		self._item_view = engine.ItemView(
 				self._textures, [view[0], item_rows])
+		self._global_view = engine.GlobalView(self._world, self._textures)
 		self._sem_view = engine.SemanticView(self._world, [
 				objects.Player, objects.Cow, objects.Zombie,
 				objects.Skeleton, objects.Arrow, objects.Plant])
+		if isinstance(world_cache, (str, pathlib.Path)):
+			world_cache = cache.WorldCache(world_cache)
+		self._world_cache = world_cache
+		self._prefetch = concurrent.futures.ThreadPoolExecutor(1) if prefetch and not lazy else None
+		self._prefetched = None
+		self._obs_buffer = None
+		self._frame_sizes = []
+		self._frames = {}
+		# Only these keys are computed for the info of every step. Lazy worlds
+		# leave out the semantic map by default, since it copies the whole area.
+		if info_keys is None:
+			info_keys = [key for key in INFO_KEYS if not (lazy and key == 'semantic')]
+		self._info_keys = tuple(info_keys)
+		for key in self._info_keys:
+			if key not in INFO_KEYS:
+				raise ValueError(f'Unknown info key: {key}')
+		self._lazy = lazy
+		self._chunk_gen = None
 		self._step = None
 		self._player = None
 		self._last_health = None
@@ -175,9 +204,17 @@ class Env(BaseClass):
 
 		self.initial_inventory = initial_inventory
 
+		if self._prefetch:
+			self._prefetch_world(1)
+
 
 	@property
 	def observation_space(self):
+		if self.out_type == "symbolic":
+			return DictSpace({
+				"semantic": BoxSpace(0, 255, tuple(self._local_grid.tolist()), np.uint8),
+				"inventory": BoxSpace(0, 255, (len(constants.items) + 3,), np.uint8),
+			})
 		return BoxSpace(0, 255, tuple(self._size) + (3,), np.uint8)
 
 
@@ -195,14 +232,21 @@ class Env(BaseClass):
 		center = (self._world.area[0] // 2, self._world.area[1] // 2)
 		self._episode += 1
 		self._step = 0
-		self._world.reset(seed=hash((self._seed, self._episode)) % (2 ** 31 - 1))
+		seed = hash((self._seed, self._episode)) % (2 ** 31 - 1)
+		self._world.reset(seed=seed)
 		self._update_time()
 		self._player = objects.Player(self._world, center, initial_inventory=self.initial_inventory)
 		self._last_health = self._player.health
 		self._world.add(self._player)
 		self._unlocked = set()
 		
-		worldgen.generate_world(self._world, self._player, **self.world_kwargs)
+		if self._lazy:
+			# Only generate the chunks around the player. The rest of the world is
+			# generated as the player gets close to it.
+			self._chunk_gen = worldgen.ChunkGenerator(self._world, self._player, **self.world_kwargs)
+			self._chunk_gen.generate(self._player.pos, 2 * max(self._view) + 1)
+		else:
+			self._generate_world(seed)
 
 		if "spawn_mobs" in self.world_kwargs:
 			for mob, num in self.world_kwargs["spawn_mobs"]:
@@ -258,7 +302,9 @@ class Env(BaseClass):
 
 				self._player._place("plant", target, material)
 
-				self._world._objects[-1].grown = 295
+				obj = self._world[target][1]
+				if isinstance(obj, objects.Plant):
+					obj.grown = 295
 
 			for name, amount in self.initial_inventory.items():
 				if "|" in name:
@@ -280,9 +326,18 @@ class Env(BaseClass):
 		self._step += 1
 		self._update_time()
 		self._player.action = constants.actions[action]
-		for obj in self._world.objects:
-			if self._player.distance(obj) < 2 * max(self._view):
-				obj.update()
+		if self._chunk_gen:
+			self._chunk_gen.generate(self._player.pos, 2 * max(self._view) + 1)
+		# The player was added first and acts first. It moves by at most one cell
+		# and the other objects do not move each other, so the objects within
+		# reach are among those selected before the player acts.
+		reach = 2 * max(self._view) - 1
+		objs = self._world.select(pos=self._player.pos, distance=reach + 1)
+		self._player.update()
+		objs = [obj for obj in objs if obj is not self._player]
+		near = np.abs(self._world.positions(objs) - self._player.pos).sum(1) <= reach
+		objs = [obj for obj, inside in zip(objs, near) if inside]
+		objects.update_objects(self._world, self._player, objs)
 		if self._step % 10 == 0:
 			for chunk, objs in self._world.chunks.items():
 				self._balance_chunk(chunk, objs)
@@ -302,24 +357,31 @@ class Env(BaseClass):
 		dead = self._player.health <= 0
 		over = self._length and self._step >= self._length
 		done = dead or over
-		info = {
-			'inventory': self._player.inventory.copy(),
-			'achievements': self._player.achievements.copy(),
-			'discount': 1 - float(dead),
-			'semantic': self._sem_view(),
-			'player_pos': self._player.pos,
-			'reward': reward,
-			"episode": {
+		keys = self._info_keys
+		info = {}
+		if 'inventory' in keys:
+			info['inventory'] = self._player.inventory.copy()
+		if 'achievements' in keys:
+			info['achievements'] = self._player.achievements.copy()
+		if 'discount' in keys:
+			info['discount'] = 1 - float(dead)
+		if 'semantic' in keys:
+			info['semantic'] = self._sem_view()
+		if 'player_pos' in keys:
+			info['player_pos'] = self._player.pos
+		if 'reward' in keys:
+			info['reward'] = reward
+		if 'episode' in keys:
+			info["episode"] = {
 				"r": reward,
 				"l": self._step,
 			}
-		}
 		if not self._reward:
 			reward = 0.0
 		return obs, reward, done, info
 
 
-	def render(self, size=None):
+	def render(self, size=None, out=None):
 		if (type(size) != list or type(size) != tuple) and len(size) != 2:
 			size = (512, 512)
 			# self._view = np.array([64, 64])
@@ -332,26 +394,141 @@ class Env(BaseClass):
 		if size is None:
 			size = self._size
 
-		unit = size // self._view
-		canvas = np.zeros(tuple(size) + (3,), np.uint8)
-		local_view = self._local_view(self._player, unit)
-		item_view = self._item_view(self._player.inventory, unit)
-		view = np.concatenate([local_view, item_view], 1)
-		border = (size - (size // self._view) * self._view) // 2
-		(x, y), (w, h) = border, view.shape[:2]
-		canvas[x: x + w, y: y + h] = view
-		return canvas.transpose((1, 0, 2))
+		return self.render_sizes([size], [out])[0]
+
+
+	def render_sizes(self, sizes, outs=None):
+		# Renders the view at several sizes in one pass over the world, in the
+		# same way as calling render() for each of them in order.
+		sizes = [np.array(size) for size in sizes]
+		outs = outs or [None] * len(sizes)
+		units = [size // self._view for size in sizes]
+		canvases, views = [], []
+		for size, unit, out in zip(sizes, units, outs):
+			if out is None:
+				canvas = np.empty(tuple(size) + (3,), np.uint8)
+			else:
+				canvas = _canvas(out, size)
+			(x, y), (w, h) = (size - unit * self._view) // 2, unit * self._view
+			split = y + unit[1] * self._local_grid[1]
+			canvas[:x] = canvas[x + w:] = 0
+			canvas[:, :y] = canvas[:, y + h:] = 0
+			canvas[x: x + w, split: y + h] = self._item_view(self._player.inventory, unit)
+			canvases.append(canvas)
+			views.append(canvas[x: x + w, y: split])
+		self._local_view.draw(self._player, units, views)
+		return [
+			canvas.transpose((1, 0, 2)) if out is None else out
+			for canvas, out in zip(canvases, outs)]
+
+
+	def render_world(self, unit=1):
+		# The whole world with unit pixels per cell and without lighting, for
+		# example one pixel per cell for a thumbnail.
+		return self._global_view(unit).transpose((1, 0, 2))
+
+
+	def add_frame_size(self, size):
+		# Every observation also renders the view at this size in the same pass,
+		# for frame() to return.
+		size = tuple(int(x) for x in size)
+		if size not in self._frame_sizes:
+			self._frame_sizes.append(size)
+
+
+	def frame(self, size):
+		# The view at the size as of the last observation, or a new render if it
+		# was not rendered along with the observation.
+		size = tuple(int(x) for x in size)
+		if size in self._frames:
+			return self._frames[size]
+		return self.render(np.array(size))
+
+
+	def set_obs_buffer(self, buffer):
+		# Observations are rendered into the buffer, which has to be a uint8
+		# array of the observation shape (HWC) or with the channels first (CHW).
+		# It can be a slice of a larger batch array. Every observation returns
+		# the buffer itself, so it is overwritten by the next step. None goes
+		# back to returning new arrays.
+		if buffer is not None:
+			_canvas(buffer, self._size)
+		self._obs_buffer = buffer
 
 
 	def _obs(self):
+		self._frames = {}
 		if self.out_type == "image":
-			return self.render(self._size)
+			return self._render_obs()
 		elif self.out_type == "dict":
 			out = {
-				"image": self.render(self._size),
+				"image": self._render_obs(),
 			}
 
 			return out
+		elif self.out_type == "symbolic":
+			return self._symbolic_obs()
+
+
+	def _render_obs(self):
+		if not self._frame_sizes:
+			return self.render(self._size, self._obs_buffer)
+		images = self.render_sizes(
+			[self._size] + self._frame_sizes,
+			[self._obs_buffer] + [None] * len(self._frame_sizes))
+		self._frames = dict(zip(self._frame_sizes, images[1:]))
+		return images[0]
+
+
+	def _symbolic_obs(self):
+		# The semantic ids of the cells in the local view, and the inventory in
+		# the order of constants.items followed by whether the player sleeps, the
+		# direction it faces as an index into left, right, up and down, and the
+		# daylight scaled to 255. Nothing is rendered.
+		facing = [(-1, 0), (+1, 0), (0, -1), (0, +1)].index(tuple(self._player.facing))
+		status = [self._player.inventory[name] for name in constants.items]
+		status += [self._player.sleeping, facing, round(255 * self._world.daylight)]
+		return {
+			"semantic": self._sem_view.window(self._player.pos, self._local_grid),
+			"inventory": np.array(status, np.uint8),
+		}
+
+
+	def _generate_world(self, seed):
+		if self._world_cache is None and self._prefetch is None:
+			worldgen.generate_world(self._world, self._player, **self.world_kwargs)
+			return
+		# The prefetched world is only used when the settings did not change
+		# since, for example through set_attr() on world_kwargs.
+		settings = seed, tuple(self._area), copy.deepcopy(self.world_kwargs)
+		if self._prefetched and self._prefetched[0] == settings:
+			record = self._prefetched[1].result()
+		else:
+			record = self._world_record(*settings)
+		worldgen.restore_world(self._world, self._player, record)
+		if self._prefetch:
+			self._prefetch_world(self._episode + 1)
+
+
+	def _prefetch_world(self, episode):
+		# Generates the world of the given episode in the background. It uses
+		# its own world and random state, so the result does not depend on
+		# what the current episode does in the meantime.
+		seed = hash((self._seed, episode)) % (2 ** 31 - 1)
+		settings = seed, tuple(self._area), copy.deepcopy(self.world_kwargs)
+		self._prefetched = settings, self._prefetch.submit(self._world_record, *settings)
+
+
+	def _world_record(self, seed, area, world_kwargs):
+		if self._world_cache:
+			key = self._world_cache.key(seed, area, world_kwargs)
+			record = self._world_cache.get(key)
+			if record is not None:
+				return record
+		record = worldgen.generate_snapshot(seed, area, **world_kwargs)
+		if self._world_cache:
+			self._world_cache.put(key, record)
+		return record
 
 
 	def _update_time(self):
@@ -408,3 +585,18 @@ class Env(BaseClass):
 			away = self._player.distance(obj.pos) >= despan_dist
 			if away:
 				self._world.remove(obj)
+
+
+def _canvas(buffer, size):
+	# A view of the buffer indexed by x, y and channel, like the canvas that
+	# render() draws into.
+	width, height = int(size[0]), int(size[1])
+	if buffer.dtype != np.uint8:
+		raise ValueError(f'Observation buffer must be uint8, not {buffer.dtype}.')
+	if buffer.shape == (height, width, 3):
+		return buffer.transpose((1, 0, 2))
+	if buffer.shape == (3, height, width):
+		return buffer.transpose((2, 1, 0))
+	raise ValueError(
+		f'Observation buffer must have shape {(height, width, 3)} or '
+		f'{(3, height, width)}, not {buffer.shape}.')
@@ -0,0 +1,220 @@
+import functools
+
+import numpy as np
+
+
+STRETCH = -1 / 6
+SQUISH = 1 / 3
+NORM = 103
+
+# The 24 gradients of the 3D OpenSimplex noise.
+GRADIENTS = np.array([
+    -11, 4, 4, -4, 11, 4, -4, 4, 11,
+    11, 4, 4, 4, 11, 4, 4, 4, 11,
+    -11, -4, 4, -4, -11, 4, -4, -4, 11,
+    11, -4, 4, 4, -11, 4, 4, -4, 11,
+    -11, 4, -4, -4, 11, -4, -4, 4, -11,
+    11, 4, -4, 4, 11, -4, 4, 4, -11,
+    -11, -4, -4, -4, -11, -4, -4, -4, -11,
+    11, -4, -4, 4, -11, -4, 4, -4, -11,
+], np.int64).reshape((-1, 3))
+
+# Vertices of the stretched unit cube and the regions that use them, in the
+# order opensimplex adds them up. Region 0 is the tetrahedron at (0, 0, 0),
+# region 1 the tetrahedron at (1, 1, 1) and region 2 the octahedron between.
+CORNERS = (
+    ((0, 0, 0), (0,)),
+    ((1, 0, 0), (0, 2)),
+    ((0, 1, 0), (0, 2)),
+    ((0, 0, 1), (0, 2)),
+    ((1, 1, 0), (1, 2)),
+    ((1, 0, 1), (1, 2)),
+    ((0, 1, 1), (1, 2)),
+    ((1, 1, 1), (1,)),
+)
+
+
+class OpenSimplex:
+
+  # NumPy version of the 3D noise of opensimplex, with the same values for the
+  # same seed, for whole arrays of coordinates at once.
+
+  def __init__(self, seed):
+    self._seed = seed
+    self._perm, self._grads = _permutation(seed)
+
+  def get_seed(self):
+    return self._seed
+
+  def noise3(self, x, y, z):
+    x, y, z = np.asarray(x), np.asarray(y), np.asarray(z)
+    # Place the coordinates on the simplectic honeycomb and find the origin of
+    # the stretched cube that contains them.
+    offset = (x + y + z) * STRETCH
+    xs, ys, zs = x + offset, y + offset, z + offset
+    xsb = np.floor(xs).astype(np.int64)
+    ysb = np.floor(ys).astype(np.int64)
+    zsb = np.floor(zs).astype(np.int64)
+    offset = (xsb + ysb + zsb) * SQUISH
+    origin = xsb, ysb, zsb
+    deltas = x - (xsb + offset), y - (ysb + offset), z - (zsb + offset)
+    ins = np.stack([xs - xsb, ys - ysb, zs - zsb])
+    total = ins.sum(0)
+    low, high = total <= 1, total >= 2
+    masks = low, high, ~low & ~high
+    value = np.zeros(total.shape)
+    for corner, regions in CORNERS:
+      mask = functools.reduce(np.logical_or, (masks[r] for r in regions))
+      value += self._contribution(origin, deltas, corner, (0, 0, 0), mask)
+    extras = zip(_extras_low(*ins), _extras_high(*ins), _extras_middle(*ins))
+    for l, h, m in extras:
+      corner, bump = (
+          tuple(
+              np.where(low, a, np.where(high, b, c))
+              for a, b, c in zip(l[i], h[i], m[i]))
+          for i in range(2))
+      value += self._contribution(origin, deltas, corner, bump, True)
+    value /= NORM
+    return value if value.ndim else float(value)
+
+  def noise3array(self, x, y, z):
+    # Same layout as opensimplex: the result has shape (z.size, y.size, x.size).
+    return self.noise3(
+        np.asarray(x)[None, None, :],
+        np.asarray(y)[None, :, None],
+        np.asarray(z)[:, None, None])
+
+  def _contribution(self, origin, deltas, corner, bump, mask):
+    # The lattice point is corner + bump. Opensimplex moves some points by a
+    # second step after the squish offset, which is kept separate as the bump
+    # so that the result rounds the same way.
+    squish = sum(c + b for c, b in zip(corner, bump)) * SQUISH
+    dx, dy, dz = (
+        delta - c - squish - b for delta, c, b in zip(deltas, corner, bump))
+    xsv, ysv, zsv = (o + c + b for o, c, b in zip(origin, corner, bump))
+    attn = 2 - dx * dx - dy * dy - dz * dz
+    mask = mask & (attn > 0)
+    attn *= attn
+    grad = self._grads[
+        (self._perm[(self._perm[xsv & 0xFF] + ysv) & 0xFF] + zsv) & 0xFF]
+    extrapolation = grad[..., 0] * dx + grad[..., 1] * dy + grad[..., 2] * dz
+    return np.where(mask, attn * attn * extrapolation, 0)
+
+
+def _extras_low(xins, yins, zins):
+  # The two lattice points outside the tetrahedron at (0, 0, 0) that may
+  # contribute, depending on which two of its vertices are the closest.
+  a_point, a_score = np.full(xins.shape, 1), xins
+  b_point, b_score = np.full(xins.shape, 2), yins
+  swap_b = (a_score >= b_score) & (zins > b_score)
+  swap_a = ~swap_b & (a_score < b_score) & (zins > a_score)
+  b_point, b_score = np.where(swap_b, 4, b_point), np.where(swap_b, zins, b_score)
+  a_point, a_score = np.where(swap_a, 4, a_point), np.where(swap_a, zins, a_score)
+  wins = 1 - (xins + yins + zins)
+  near = (wins > a_score) | (wins > b_score)
+  c = np.where(near, np.where(b_score > a_score, b_point, a_point), a_point | b_point)
+  x, y, z = ((c & bit) != 0 for bit in (1, 2, 4))
+  # Axes in c go to 1. With (0, 0, 0) among the closest, the other axes step
+  # back once across the two points, otherwise only in the second point.
+  ext0 = (
+      np.where(x, 1, np.where(near, -1, 0)),
+      np.where(y, 1, np.where(near & x, -1, 0)),
+      np.where(z, 1, 0))
+  ext1 = (
+      np.where(x, 1, np.where(near, 0, -1)),
+      np.where(y, 1, np.where(near & x, 0, -1)),
+      np.where(z, 1, -1))
+  return (ext0, (0, 0, 0)), (ext1, (0, 0, 0))
+
+
+def _extras_high(xins, yins, zins):
+  # The two lattice points outside the tetrahedron at (1, 1, 1) that may
+  # contribute, depending on which two of its vertices are the closest.
+  a_point, a_score = np.full(xins.shape, 6), xins
+  b_point, b_score = np.full(xins.shape, 5), yins
+  swap_b = (a_score <= b_score) & (zins < b_score)
+  swap_a = ~swap_b & (a_score > b_score) & (zins < a_score)
+  b_point, b_score = np.where(swap_b, 3, b_point), np.where(swap_b, zins, b_score)
+  a_point, a_score = np.where(swap_a, 3, a_point), np.where(swap_a, zins, a_score)
+  wins = 3 - (xins + yins + zins)
+  near = (wins < a_score) | (wins < b_score)
+  c = np.where(near, np.where(b_score < a_score, b_point, a_point), a_point & b_point)
+  x, y, z = ((c & bit) != 0 for bit in (1, 2, 4))
+  # Axes not in c stay at 0. With (1, 1, 1) among the closest, the axes in c
+  # step out to 2 once across the two points, otherwise only in the second
+  # point. Opensimplex moves the y axis out to 2 in a second step.
+  ext0 = (
+      np.where(x, np.where(near, 2, 1), 0),
+      np.where(y, 1, 0),
+      np.where(z, 1, 0))
+  ext1 = (
+      np.where(x, np.where(near, 1, 2), 0),
+      np.where(y, np.where(near, 1, 2), 0),
+      np.where(z, 2, 0))
+  bump0 = (0, np.where(near & y & ~x, 1, 0), 0)
+  bump1 = (0, np.where(near & y & x, 1, 0), 0)
+  return (ext0, bump0), (ext1, bump1)
+
+
+def _extras_middle(xins, yins, zins):
+  # The two lattice points outside the octahedron that may contribute,
+  # depending on which two of its vertices are the closest.
+  p1, p2, p3 = xins + yins, xins + zins, yins + zins
+  a_far, b_far, far = p1 > 1, p2 > 1, p3 > 1
+  a_score = np.where(a_far, p1 - 1, 1 - p1)
+  b_score = np.where(b_far, p2 - 1, 1 - p2)
+  score = np.where(far, p3 - 1, 1 - p3)
+  a_point = np.where(a_far, 3, 4)
+  b_point = np.where(b_far, 5, 2)
+  swap_a = (a_score <= b_score) & (a_score < score)
+  swap_b = ~swap_a & (a_score > b_score) & (b_score < score)
+  a_point = np.where(swap_a, np.where(far, 6, 1), a_point)
+  b_point = np.where(swap_b, np.where(far, 6, 1), b_point)
+  a_far = np.where(swap_a, far, a_far)
+  b_far = np.where(swap_b, far, b_far)
+  same = a_far == b_far
+  far_point = np.where(a_far, a_point, b_point)
+  near_point = np.where(a_far, b_point, a_point)
+  # A permutation of (-1, 1, 1) with the -1 on the first axis missing from
+  # the closest points, and a permutation of (2, 0, 0) with the 2 on the
+  # first axis they share.
+  flip = _first_axis(np.where(same, a_point | b_point, far_point), False)
+  flip = tuple(np.where(flip == axis, -1, 1) for axis in range(3))
+  out = _first_axis(np.where(same, a_point & b_point, near_point), True)
+  out = tuple(np.where(out == axis, 2, 0) for axis in range(3))
+  # On the same side, the extra points are (1, 1, 1) and the (2, 0, 0) point
+  # or (0, 0, 0) and the (-1, 1, 1) point. On different sides, they are the
+  # (-1, 1, 1) point and the (2, 0, 0) point, whose 2 opensimplex adds in a
+  # second step.
+  ext0 = tuple(np.where(same, np.where(a_far, 1, 0), f) for f in flip)
+  ext1 = tuple(
+      np.where(same, np.where(a_far, o, f), 0) for o, f in zip(out, flip))
+  bump1 = tuple(np.where(same, 0, o) for o in out)
+  return (ext0, (0, 0, 0)), (ext1, bump1)
+
+
+def _first_axis(c, value):
+  # The first of the x, y and z axes whose bit in c is set (or unset).
+  x, y = ((c & bit) != 0 for bit in (1, 2))
+  return np.where(x == value, 0, np.where(y == value, 1, 2))
+
+
+@functools.lru_cache(64)
+def _permutation(seed):
+  # Same permutation as opensimplex, generated by a 64-bit linear congruential
+  # generator that wraps around like a signed integer.
+  def step(seed):
+    seed = (seed * 6364136223846793005 + 1442695040888963407) % 2 ** 64
+    return seed - 2 ** 64 if seed >= 2 ** 63 else seed
+  perm = np.zeros(256, np.int64)
+  source = list(range(256))
+  seed = step(step(step(seed)))
+  for i in range(255, -1, -1):
+    seed = step(seed)
+    r = (seed + 31) % (i + 1)
+    perm[i] = source[r]
+    source[r] = source[i]
+  grads = GRADIENTS[perm % len(GRADIENTS)]
+  perm.setflags(write=False)
+  grads.setflags(write=False)
+  return perm, grads
@@ -7,11 +7,15 @@ from . import engine
 
 class Object:
 
+	pos = engine.field('pos')
+	_health = engine.field('health')
+	_slot = None
+
 	def __init__(self, world, pos):
 		self.world = world
 		self.pos = np.array(pos)
 		self.random = world.random
-		self.inventory = {'health': 0}
+		self._health = 0
 		self.removed = False
 
 	@property
@@ -24,11 +28,11 @@ class Object:
 
 	@property
 	def health(self):
-		return self.inventory['health']
+		return self._health
 
 	@health.setter
 	def health(self, value):
-		self.inventory['health'] = max(0, value)
+		self._health = max(0, value)
 
 	@property
 	def all_dirs(self):
@@ -68,6 +72,8 @@ class Object:
 
 class Player(Object):
 
+	facing = engine.field('facing')
+
 	def __init__(self, world, pos, initial_inventory=None):
 		super().__init__(world, pos)
 		self.facing = (0, 1)
@@ -95,6 +101,16 @@ class Player(Object):
 		}[tuple(self.facing)]
 
 
+	@property
+	def health(self):
+		# The health of the player is part of its inventory.
+		return self.inventory['health']
+
+	@health.setter
+	def health(self, value):
+		self.inventory['health'] = max(0, value)
+
+
 	@property
 	def walkable(self):
 		return constants.walkable + ['lava']
@@ -294,6 +310,8 @@ class Cow(Object):
 
 class Zombie(Object):
 
+	cooldown = engine.field('cooldown')
+
 	def __init__(self, world, pos, player):
 		super().__init__(world, pos)
 		self.player = player
@@ -327,6 +345,8 @@ class Zombie(Object):
 
 class Skeleton(Object):
 
+	reload = engine.field('reload')
+
 	def __init__(self, world, pos, player):
 		super().__init__(world, pos)
 		self.player = player
@@ -366,6 +386,8 @@ class Skeleton(Object):
 
 class Arrow(Object):
 
+	facing = engine.field('facing')
+
 	def __init__(self, world, pos, facing):
 		super().__init__(world, pos)
 		self.facing = facing
@@ -435,3 +457,135 @@ class Fence(Object):
 
 	def update(self):
 		pass
+
+
+def update_objects(world, player, objs):
+	# Updates the objects in their order, with the same outcome as calling their
+	# update methods one by one. Cows, zombies and skeletons that chase or flee
+	# the player are updated in a batch, which mirrors their update methods and
+	# has to be changed together with them. The batch needs the generator of the
+	# random state, which is a private attribute of NumPy.
+	mobs = [obj for obj in objs if type(obj) in _MOBS]
+	if not mobs or not hasattr(world.random, '_bit_generator'):
+		for obj in objs:
+			obj.update()
+		return
+	_update_batch(world, player, objs, mobs)
+
+
+def _update_batch(world, player, objs, mobs):
+	# Distances, directions and random numbers are computed as arrays up front,
+	# and only the moves are applied one at a time in the order of the objects,
+	# so mobs that target the same cell resolve it like the sequential updates.
+	positions = world.positions(mobs)
+	offset = player.pos - positions
+	dists = np.abs(offset)
+	# The steps of toward() on the short axis and on the long axis, so that
+	# they can be picked by the long_axis argument.
+	along_x, along_y = np.sign(offset) * (1, 0), np.sign(offset) * (0, 1)
+	long = (dists[:, 0] > dists[:, 1])[:, None]
+	toward = np.stack([
+			np.where(long, along_y, along_x), np.where(long, along_x, along_y)], 1)
+	positions, dists = positions.tolist(), dists.sum(1).tolist()
+	toward, away = toward.tolist(), (-toward).tolist()
+	px, py = player.pos.tolist()
+	walkable = [
+			world._mat_names[i] in constants.walkable
+			for i in range(len(world._mat_names))]
+	width, height = world.area
+	obj_map, mat_map = world._obj_map, world._mat_map
+
+	def move(obj, x, y, direction):
+		# Like Object.move(), for mobs at known positions.
+		x, y = x + direction[0], y + direction[1]
+		if not (0 <= x < width and 0 <= y < height):
+			return False
+		if obj_map[x, y] or not walkable[mat_map[x, y]]:
+			return False
+		world.move(obj, (x, y))
+		return True
+
+	draws = _Draws(world.random, _DRAWS * len(mobs))
+	index = 0
+	for obj in objs:
+		kind = type(obj)
+		if kind not in _MOBS:
+			if kind in _STILL:
+				obj.update()
+			else:
+				# Other objects may draw random numbers of their own.
+				draws.finish()
+				obj.update()
+				draws = _Draws(world.random, _DRAWS * (len(mobs) - index))
+			continue
+		(x, y), dist = positions[index], dists[index]
+		closer, farther = toward[index], away[index]
+		index += 1
+		if obj.health <= 0:
+			world.remove(obj)
+		if kind is Cow:
+			if draws.uniform() < 0.5:
+				move(obj, x, y, _DIRS[draws.randint()])
+		elif kind is Zombie:
+			if dist <= 8 and draws.uniform() < 0.9:
+				direction = closer[draws.uniform() < 0.8]
+			else:
+				direction = _DIRS[draws.randint()]
+			if move(obj, x, y, direction) and not obj.removed:
+				x, y = x + direction[0], y + direction[1]
+			if abs(px - x) + abs(py - y) <= 1:
+				if obj.cooldown:
+					obj.cooldown -= 1
+				else:
+					obj.player.health -= 7 if obj.player.sleeping else 2
+					obj.cooldown = 5
+		else:
+			obj.reload = max(0, obj.reload - 1)
+			if dist <= 3:
+				if move(obj, x, y, farther[draws.uniform() < 0.6]):
+					continue
+			if dist <= 5 and draws.uniform() < 0.5:
+				obj._shoot(np.array(closer[True]))
+			elif dist <= 8 and draws.uniform() < 0.3:
+				move(obj, x, y, closer[draws.uniform() < 0.6])
+			elif draws.uniform() < 0.2:
+				move(obj, x, y, _DIRS[draws.randint()])
+	draws.finish()
+
+
+class _Draws:
+
+	# Replays what uniform() and randint(0, 4) of a np.random.RandomState
+	# return, from raw outputs of its generator that are drawn as one array.
+	# The outputs that were not used are given back by finish().
+
+	def __init__(self, random, count):
+		self._generator = random._bit_generator
+		self._state = self._generator.state
+		raw = self._generator.random_raw(count + 1)
+		# A uniform number takes two outputs and randint(0, 4) takes one.
+		self._floats = (
+				((raw[:-1] >> 5) * 67108864.0 + (raw[1:] >> 6)) /
+				9007199254740992.0).tolist()
+		self._ints = (raw & 3).tolist()
+		self._index = 0
+
+	def uniform(self):
+		self._index += 2
+		return self._floats[self._index - 2]
+
+	def randint(self):
+		self._index += 1
+		return self._ints[self._index - 1]
+
+	def finish(self):
+		self._generator.state = self._state
+		self._generator.random_raw(self._index)
+
+
+# Objects that are updated in a batch, the most random outputs one of them
+# uses per update, and objects that do not draw random numbers.
+_MOBS = (Cow, Zombie, Skeleton)
+_DRAWS = 9
+_STILL = (Arrow, Plant, Fence)
+_DIRS = ((-1, 0), (+1, 0), (0, -1), (0, +1))
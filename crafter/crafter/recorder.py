@@ -71,6 +71,8 @@ class VideoRecorder:
   def __init__(self, env, directory, size=(512, 512)):
     if not hasattr(env, 'episode_name'):
       env = EpisodeName(env)
+    # The env renders the frames along with its observations.
+    env.add_frame_size(size)
     self._env = env
     self._directory = pathlib.Path(directory).expanduser()
     self._directory.mkdir(exist_ok=True, parents=True)
@@ -84,12 +86,12 @@ class VideoRecorder:
 
   def reset(self):
     obs = self._env.reset()
-    self._frames = [self._env.render(self._size)]
+    self._frames = [self._env.frame(self._size)]
     return obs
 
   def step(self, action):
     obs, reward, done, info = self._env.step(action)
-    self._frames.append(self._env.render(self._size))
+    self._frames.append(self._env.frame(self._size))
     if done:
       self._save()
     return obs, reward, done, info
@@ -0,0 +1,370 @@
+import multiprocessing
+from multiprocessing import resource_tracker
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from . import constants
+from . import env as envlib
+
+
+class BatchEnv:
+
+  # Steps a batch of environments, split into shards over worker processes, and
+  # writes their images and info keys into a ring of shared arrays.
+
+  def __init__(
+      self, configs, processes=0, context=None, info_keys=None, ring=1):
+    configs = list(configs)
+    self.num_envs = 0
+    self._info_keys = None if info_keys is None else tuple(info_keys)
+    # Returned images stay valid for this many more resets and steps.
+    self._ring = ring
+    self._slot = 0
+    self._workers = []
+    self._blocks = []
+    self._layout = None
+    self._arrays = None
+    self._shard = None
+    self._actions = None
+    if processes:
+      # Workers have to share the resource tracker of this process. Otherwise
+      # they start their own, which unlinks the shared memory when they exit.
+      resource_tracker.ensure_running()
+      context = multiprocessing.get_context(context)
+      for _ in range(max(min(processes, len(configs)), 1)):
+        pipe, child = context.Pipe()
+        process = context.Process(target=_work, args=(child,), daemon=True)
+        process.start()
+        child.close()
+        self._workers.append((pipe, process, 0, 0))
+    try:
+      self.configure(configs)
+    except Exception:
+      self.close()
+      raise
+
+  def configure(self, configs):
+    # Replaces the environments by new ones with the given keyword arguments,
+    # in the same worker processes. The arrays are kept when their number and
+    # shapes stay the same. Call reset() afterwards.
+    configs = [dict(config) for config in configs]
+    count = len(configs)
+    if self._workers:
+      bounds = np.linspace(0, count, len(self._workers) + 1).astype(int).tolist()
+      self._workers = [
+          (pipe, process, start, stop) for (pipe, process, _, _), start, stop
+          in zip(self._workers, bounds[:-1], bounds[1:])]
+      for pipe, _, start, stop in self._workers:
+        pipe.send(('configure', (configs[start: stop], self._info_keys)))
+      layouts = self._receive()
+    else:
+      self._shard = _Shard(configs, self._info_keys)
+      layouts = [self._shard.layout]
+    layouts = [layout for layout in layouts if layout is not None]
+    if not layouts:
+      raise ValueError('There are no environments.')
+    if any(layout != layouts[0] for layout in layouts):
+      raise ValueError('Environments have different image or info shapes.')
+    if layouts[0] != self._layout or count != self.num_envs:
+      self._allocate(layouts[0], count)
+    if self._workers:
+      names = {
+          key: block.name for key, block in zip(self._arrays, self._blocks)}
+      for pipe, _, start, stop in self._workers:
+        pipe.send(('attach', (names, self._layout, count, self._ring, start, stop)))
+      self._receive()
+    else:
+      self._shard.attach(self._arrays)
+    self._slot = 0
+
+  def __len__(self):
+    return self.num_envs
+
+  @property
+  def obs(self):
+    return self._arrays['image_'][self._slot]
+
+  @property
+  def observation_space(self):
+    return envlib.BoxSpace(0, 255, self._layout['image_'][0], np.uint8)
+
+  @property
+  def action_space(self):
+    return envlib.DiscreteSpace(len(constants.actions))
+
+  def reset(self):
+    self._slot = (self._slot + 1) % self._ring
+    if self._workers:
+      self._broadcast('reset', self._slot)
+    else:
+      self._shard.reset(self._slot)
+    return self.obs
+
+  def step_async(self, actions):
+    actions = np.asarray(actions)
+    self._slot = (self._slot + 1) % self._ring
+    if self._workers:
+      for pipe, _, start, stop in self._workers:
+        pipe.send(('step', (self._slot, actions[start: stop])))
+    else:
+      self._actions = actions
+
+  def step_wait(self):
+    if self._workers:
+      infos = self._receive()
+      if not self._info_keys:
+        infos = [info for shard in infos for info in shard]
+    else:
+      infos = self._shard.step(self._slot, self._actions)
+    if self._info_keys:
+      infos = self._infos()
+    # Done environments were reset already, like the vector envs of
+    # stable-baselines3, and their last image is kept for the infos.
+    for index in np.nonzero(self.dones)[0]:
+      infos[index]['terminal_observation'] = (
+          self._arrays['terminal_'][index].copy())
+    return self.obs, self.rewards.copy(), self.dones.copy(), infos
+
+  def step(self, actions):
+    self.step_async(actions)
+    return self.step_wait()
+
+  def call(self, name, *args, indices=None, **kwargs):
+    # Calls the method of the environments at the indices, or of all of them,
+    # and returns the results in the order of the indices.
+    indices = range(self.num_envs) if indices is None else indices
+    indices = [int(index) for index in np.atleast_1d(indices)]
+    chosen = sorted(set(indices))
+    if self._workers:
+      for pipe, _, start, stop in self._workers:
+        local = [index - start for index in chosen if start <= index < stop]
+        pipe.send(('call', (name, args, kwargs, local)))
+      results = [result for shard in self._receive() for result in shard]
+    else:
+      results = self._shard.call(name, args, kwargs, chosen)
+    results = dict(zip(chosen, results))
+    return [results[index] for index in indices]
+
+  def close(self):
+    for pipe, process, _, _ in self._workers:
+      try:
+        pipe.send(('close', None))
+      except (BrokenPipeError, EOFError):
+        pass
+      process.join()
+      pipe.close()
+    self._workers = []
+    self._release()
+
+  def _infos(self):
+    infos = [{} for _ in range(self.num_envs)]
+    for key in self._info_keys:
+      array = self._arrays[key]
+      if key in _INFO_NAMES:
+        values = [dict(zip(_INFO_NAMES[key], row)) for row in array.tolist()]
+      elif array.ndim > 1:
+        values = [row.copy() for row in array]
+      else:
+        values = array.tolist()
+      for info, value in zip(infos, values):
+        info[key] = value
+    return infos
+
+  def _allocate(self, layout, count):
+    self._release()
+    self._layout = layout
+    self.num_envs = count
+    self._arrays = {
+        key: self._array(_shape(key, count, shape, self._ring), dtype)
+        for key, (shape, dtype) in layout.items()}
+    self.rewards = self._arrays['reward_']
+    self.dones = self._arrays['done_']
+
+  def _release(self):
+    # The blocks stay mapped while arrays of them are still in use, but the
+    # names are removed right away.
+    self._arrays = self.rewards = self.dones = None
+    for block in self._blocks:
+      block.unlink()
+      try:
+        block.close()
+      except BufferError:
+        pass
+    self._blocks = []
+
+  def _array(self, shape, dtype):
+    if not self._workers:
+      return np.zeros(shape, dtype)
+    size = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+    block = shared_memory.SharedMemory(create=True, size=size)
+    self._blocks.append(block)
+    array = np.ndarray(shape, dtype, block.buf)
+    array[:] = 0
+    return array
+
+  def _broadcast(self, command, data=None):
+    for pipe, _, _, _ in self._workers:
+      pipe.send((command, data))
+    return [result for shard in self._receive() for result in shard]
+
+  def _receive(self):
+    # Waits for all workers before raising the first error, so that no
+    # replies are left in the pipes.
+    results = [pipe.recv() for pipe, _, _, _ in self._workers]
+    for result in results:
+      if isinstance(result, Exception):
+        raise result
+    return results
+
+
+class _Shard:
+
+  def __init__(self, configs, info_keys):
+    # The envs only compute the info keys that are shared, unless their
+    # config asks for others.
+    if info_keys is not None:
+      configs = [
+          dict(config, info_keys=config.get('info_keys', info_keys))
+          for config in configs]
+    self.envs = [envlib.Env(**config) for config in configs]
+    self._info_keys = info_keys or ()
+    for env in self.envs:
+      if env.out_type == 'symbolic':
+        raise ValueError('Batched environments need image observations.')
+    self._arrays = None
+    self.layout = None
+    if not self.envs:
+      return
+    sizes = {tuple(env._size.tolist()) for env in self.envs}
+    if len(sizes) > 1:
+      raise ValueError(f'Environments have different image sizes: {sizes}')
+    width, height = sizes.pop()
+    # The shape and type of the arrays per environment. Fields that are not
+    # info keys end with an underscore.
+    self.layout = {
+        'image_': ((height, width, 3), np.uint8),
+        'terminal_': ((height, width, 3), np.uint8),
+        'reward_': ((), np.float32),
+        'done_': ((), bool)}
+    for key in self._info_keys:
+      layouts = {_info_layout(env, key) for env in self.envs}
+      if len(layouts) > 1:
+        raise ValueError(f'Environments have different {key} shapes.')
+      self.layout[key] = layouts.pop()
+
+  def attach(self, arrays):
+    self._arrays = arrays
+
+  def reset(self, slot):
+    for env, buffer in zip(self.envs, self._arrays['image_'][slot]):
+      env.set_obs_buffer(buffer)
+      env.reset()
+    return []
+
+  def step(self, slot, actions):
+    infos = []
+    items = zip(self.envs, actions, self._arrays['image_'][slot])
+    for index, (env, action, buffer) in enumerate(items):
+      env.set_obs_buffer(buffer)
+      _, reward, done, info = env.step(action)
+      if done:
+        self._arrays['terminal_'][index] = buffer
+        env.reset()
+      self._arrays['reward_'][index] = reward
+      self._arrays['done_'][index] = done
+      for key in self._info_keys:
+        value = info[key]
+        if key in _INFO_NAMES:
+          value = [value[name] for name in _INFO_NAMES[key]]
+        self._arrays[key][index] = value
+      infos.append(info)
+    return None if self._info_keys else infos
+
+  def call(self, name, args, kwargs, indices):
+    return [getattr(self.envs[index], name)(*args, **kwargs) for index in indices]
+
+
+# Info fields that are dicts, stored in the order of these names.
+_INFO_NAMES = {
+    'inventory': list(constants.items),
+    'achievements': list(constants.achievements),
+}
+
+
+def _info_layout(env, key):
+  # The shape and type of an info field.
+  if key in _INFO_NAMES:
+    return (len(_INFO_NAMES[key]),), np.int32
+  if key in ('discount', 'reward'):
+    return (), np.float32
+  if key == 'player_pos':
+    return (2,), np.int64
+  if key == 'semantic':
+    return tuple(env._world.area), env._world._mat_map.dtype
+  raise ValueError(f'Info key {key} cannot be shared.')
+
+
+def _shape(key, count, shape, ring):
+  # Images have an axis for the slots of the ring before the environments.
+  return ((ring, count) if key == 'image_' else (count,)) + tuple(shape)
+
+
+def _work(pipe):
+  # Runs a shard in a worker process. Its arrays are slices of the shared
+  # memory blocks of the batch, which the parent process owns and unlinks.
+  # Errors are sent back to be raised in the parent process.
+  shard, blocks = None, {}
+  try:
+    while True:
+      command, data = pipe.recv()
+      if command == 'close':
+        break
+      try:
+        if command == 'configure':
+          shard = None
+          shard = _Shard(*data)
+          result = shard.layout
+        elif command == 'attach':
+          names, layout, count, ring, start, stop = data
+          blocks = _reopen(blocks, names.values())
+          arrays = {}
+          for key, (shape, dtype) in layout.items():
+            array = np.ndarray(
+                _shape(key, count, shape, ring), dtype, blocks[names[key]].buf)
+            if key == 'image_':
+              arrays[key] = array[:, start: stop]
+            else:
+              arrays[key] = array[start: stop]
+          shard.attach(arrays)
+          result = None
+        elif command == 'reset':
+          result = shard.reset(data)
+        elif command == 'step':
+          result = shard.step(*data)
+        elif command == 'call':
+          result = shard.call(*data)
+        else:
+          raise ValueError(f'Unknown command: {command}')
+      except Exception as e:
+        result = e
+      pipe.send(result)
+  except (KeyboardInterrupt, EOFError):
+    pass
+  finally:
+    pipe.close()
+
+
+def _reopen(blocks, names):
+  # Opens the blocks that are not open yet and closes the ones that are no
+  # longer used, unless arrays of them are still around.
+  opened = {}
+  for name in names:
+    opened[name] = blocks.pop(name, None) or shared_memory.SharedMemory(name)
+  for block in blocks.values():
+    try:
+      block.close()
+    except BufferError:
+      opened[block.name] = block
+  return opened
+
@@ -1,21 +1,153 @@
+import concurrent.futures
 import functools
+import os
 
 import numpy as np
 import opensimplex
 
 from . import constants
+from . import engine
+from . import noise
 from . import objects
 
 
-def generate_world(world, player, **kwargs):
-	simplex = opensimplex.OpenSimplex(seed=world.random.randint(0, 2 ** 31 - 1))
+def generate_world(world, player, vectorized=True, **kwargs):
+	seed = world.random.randint(0, 2 ** 31 - 1)
 	tunnels = np.zeros(world.area, bool)
-	for x in range(world.area[0]):
-			for y in range(world.area[1]):
-					_set_material(world, (x, y), player, tunnels, simplex, **kwargs)
-	for x in range(world.area[0]):
-			for y in range(world.area[1]):
-					_set_object(world, (x, y), player, tunnels, **kwargs)
+	chunk = (0, world.area[0], 0, world.area[1])
+	if vectorized:
+		simplex = noise.OpenSimplex(seed)
+		_set_materials(world, player.pos, tunnels, simplex, world.random, chunk, **kwargs)
+	else:
+		simplex = opensimplex.OpenSimplex(seed=seed)
+		for x in range(world.area[0]):
+				for y in range(world.area[1]):
+						_set_material(world, (x, y), player, tunnels, simplex, **kwargs)
+	_set_objects(world, player, player.pos, tunnels, world.random, chunk, **kwargs)
+	return tunnels
+
+
+def generate_worlds(seeds, area=(64, 64), processes=None, **kwargs):
+	# Generates the worlds of the seeds like env resets, over a pool of processes
+	# unless processes is 0 or 1. Returns the material ids, a table of the
+	# initial objects (world, type, x, y, health) and the material counts.
+	seeds = [int(seed) for seed in seeds]
+	generate = functools.partial(generate_snapshot, area=tuple(area), **kwargs)
+	if processes in (0, 1):
+		records = list(map(generate, seeds))
+	else:
+		processes = processes or os.cpu_count()
+		chunksize = max(1, len(seeds) // (4 * processes))
+		with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+			records = list(pool.map(generate, seeds, chunksize=chunksize))
+	materials = np.zeros((len(seeds), *area), np.uint8)
+	histograms = np.zeros((len(seeds), len(constants.materials) + 1), np.int64)
+	tables = [np.zeros((0, 5), np.int32)]
+	for index, record in enumerate(records):
+		materials[index] = record['materials']
+		histograms[index] = np.bincount(
+				materials[index].ravel(), minlength=histograms.shape[1])
+		tables.append(np.insert(record['objects'], 0, index, axis=1))
+	table = np.concatenate(tables)
+	return materials, table, histograms
+
+
+def generate_snapshot(seed, area, **kwargs):
+	# Generates a world for the seed with the player in the center and returns
+	# it as a record of snapshot_world().
+	world = engine.World(area, constants.materials, (12, 12))
+	world.reset(seed=seed)
+	player = objects.Player(world, (world.area[0] // 2, world.area[1] // 2))
+	world.add(player)
+	tunnels = generate_world(world, player, **kwargs)
+	return snapshot_world(world, tunnels)
+
+
+class ChunkGenerator:
+
+	# Generates each chunk the first time it comes near a position, with its own
+	# random state and its own share of the mob caps, so the result does not
+	# depend on the order of the visits.
+
+	def __init__(self, world, player, **kwargs):
+		self._world = world
+		self._player = player
+		self._center = tuple(player.pos)
+		self._seed = world.random.randint(0, 2 ** 31 - 1)
+		self._simplex = noise.OpenSimplex(self._seed)
+		self._tunnels = np.zeros(world.area, bool)
+		self._kwargs = kwargs
+		size = world._chunk_size
+		self._generated = np.zeros((
+				-(-world.area[0] // size[0]), -(-world.area[1] // size[1])), bool)
+		self._order = np.random.RandomState(self._seed).permutation(
+				self._generated.size).reshape(self._generated.shape)
+
+	def generate(self, pos, distance):
+		(x, y), (csx, csy) = pos, self._world._chunk_size
+		imin, imax = max(0, (x - distance) // csx), (x + distance) // csx + 1
+		jmin, jmax = max(0, (y - distance) // csy), (y + distance) // csy + 1
+		if self._generated[imin: imax, jmin: jmax].all():
+			return
+		for i, j in zip(*np.nonzero(~self._generated[imin: imax, jmin: jmax])):
+			i, j = i + imin, j + jmin
+			self._generated[i, j] = True
+			chunk = self._world.chunk_key((i * csx, j * csy))
+			random = np.random.RandomState([self._seed, i, j])
+			kwargs = dict(self._kwargs)
+			# The caps are split evenly over the chunks, with the remainder going to
+			# chunks in a random order of the seed, and count only the mobs spawned
+			# in the chunk.
+			index, count = self._order[i, j], self._generated.size
+			for name in ('max_num_cows', 'max_num_zombies', 'max_num_skeletons'):
+				if name in kwargs:
+					kwargs[name] = kwargs[name] // count + int(index < kwargs[name] % count)
+			_set_materials(self._world, self._center, self._tunnels, self._simplex, random, chunk, **kwargs)
+			_set_objects(self._world, self._player, self._center, self._tunnels, random, chunk, counted=False, **kwargs)
+
+
+def snapshot_world(world, tunnels):
+	# Captures what generate_world() leaves behind in a single record, so the
+	# world can be stored or built elsewhere and restored later.
+	table = [
+			(_SNAPSHOT_TYPES.index(type(obj)), obj.pos[0], obj.pos[1], obj.health)
+			for obj in world.objects if not isinstance(obj, objects.Player)]
+	_, keys, pos, has_gauss, gauss = world.random.get_state()
+	record = np.zeros((), [
+			('materials', np.uint8, world.area),
+			('tunnels', bool, world.area),
+			('objects', np.int32, (len(table), 4)),
+			('random_keys', np.uint32, keys.shape),
+			('random_pos', np.int64),
+			('random_has_gauss', np.int64),
+			('random_gauss', np.float64)])
+	record['materials'] = world._mat_map
+	record['tunnels'] = tunnels
+	record['objects'] = np.array(table, np.int32).reshape((-1, 4))
+	record['random_keys'] = keys
+	record['random_pos'] = pos
+	record['random_has_gauss'] = has_gauss
+	record['random_gauss'] = gauss
+	return record
+
+
+def restore_world(world, player, record):
+	# Inverse of snapshot_world() for a world that only contains the player.
+	world._mat_map[:] = record['materials']
+	for type_, x, y, health in record['objects'].tolist():
+			cls = _SNAPSHOT_TYPES[type_]
+			if cls is objects.Cow:
+					obj = cls(world, (x, y))
+			else:
+					obj = cls(world, (x, y), player)
+			obj.health = health
+			world.add(obj)
+	world.random.set_state((
+			'MT19937', np.array(record['random_keys']), int(record['random_pos']),
+			int(record['random_has_gauss']), float(record['random_gauss'])))
+
+
+_SNAPSHOT_TYPES = (objects.Cow, objects.Zombie, objects.Skeleton)
 
 
 def _set_material(world, pos, player, tunnels, simplex, **kwargs):
@@ -80,29 +212,181 @@ def _set_material(world, pos, player, tunnels, simplex, **kwargs):
 			world[x, y] = 'grass'
 
 
-def _set_object(world, pos, player, tunnels, **kwargs):
-	x, y = pos
-	
-	uniform = world.random.uniform
-	dist = np.sqrt((x - player.pos[0]) ** 2 + (y - player.pos[1]) ** 2)
-	material, _ = world[x, y]
+def _set_materials(world, center, tunnels, simplex, random, chunk, **kwargs):
+	# Computes the same map as calling _set_material() for every cell of the
+	# chunk, but on whole arrays. The random numbers are consumed in the same
+	# order as the per-cell loop, so a seed produces the same world either way.
+	xmin, xmax, ymin, ymax = chunk
+	xs, ys = np.arange(xmin, xmax), np.arange(ymin, ymax)
+	x, y = np.meshgrid(xs, ys, indexing='ij')
+	noises = _simplex_grids(simplex, [
+			(xs, ys, 8, 3),
+			(xs, ys, 3, {15: 1, 5: 0.15}, False),
+			(xs, ys, 0, {15: 1, 5: 0.3}),
+			(xs, ys, 6, 7),
+			(2 * xs, ys / 5, 7, 3),
+			(xs / 5, 2 * ys, 7, 3),
+			(xs, ys, 4, 9),
+			(xs, ys, 5, 7),
+			(xs, ys, 6, 5),
+	])
+	start_noise, water, mountain, cave, horizontal, vertical, sand, tree, lava = noises
+	start = 4 - np.sqrt((x - center[0]) ** 2 + (y - center[1]) ** 2)
+	start += 2 * start_noise
+	start = 1 / (1 + np.exp(-start))
+	water = water + 0.1
+	water -= 2 * start
+	mountain -= 4 * start + 0.3 * water
 
-	if material not in constants.walkable:
-			return
-	
+	start_thres = 0.5
+	start_material = "grass"
+	if kwargs["target_biome"] == "mountain":
+		mountain = abs(mountain)
+		mountain *= 2
+		water *= 0.1
+		start_thres = 0.6
+		start_material = "path"
+	elif kwargs["target_biome"] == "beaches":
+		mountain *= 0.1
+		start_thres = 0.8
+		start_material = "grass"
+	elif kwargs["target_biome"] == "grassland":
+		water *= 0.1
+		mountain *= 0.1
+		start_thres = 0.6
+		start_material = "grass"
+
+	materials = np.full(x.shape, world._mat_ids['grass'], np.uint8)
+	free = np.ones(x.shape, bool)
+	tunnel = tunnels[xmin: xmax, ymin: ymax]
+
+	def assign(mask, material):
+		mask = mask & free
+		materials[mask] = world._mat_ids[material]
+		free[mask] = False
+		return mask
+
+	assign(start > start_thres, start_material)
+	mountains = free & (mountain > 0.15) & kwargs["enable_mountain"]
+	if kwargs["enable_path"]:
+		assign(mountains & (cave > 0.15) & (mountain > 0.3), 'path')    # cave
+		tunnel |= assign(mountains & (horizontal > 0.4), 'path')    # horizonal tunnle
+		tunnel |= assign(mountains & (vertical > 0.4), 'path')    # vertical tunnle
+	lowlands = free & ~mountains
+	if kwargs["enable_sand"]:
+		assign(lowlands & (0.25 < water) & (water <= 0.35) & (sand > -0.2), 'sand')
+	if kwargs["enable_water"]:
+		assign(lowlands & (water > 0.3), 'water')
+	ores = free & mountains & (mountain > 0.18)
+	trees = free & lowlands & (tree > 0)
+	coal, iron, diamond, tree = _draw_uniforms(random, ores, trees, **kwargs)
+	assign(coal, 'coal')
+	assign(iron, 'iron')
+	assign(diamond, 'diamond')
+	if kwargs["enable_lava"]:
+		assign(mountains & (mountain > 0.3) & (lava > 0.35), 'lava')
+	assign(mountains, 'stone')
+	assign(tree, 'tree')
+	world._mat_map[xmin: xmax, ymin: ymax] = materials
+
+
+def _draw_uniforms(random, ores, trees, **kwargs):
+	# Replays the uniform() calls that _set_material() makes in row-major cell
+	# order. Tree candidates draw once. Ore candidates draw for coal, then iron,
+	# then diamond, and stop at the first hit, so their draw count depends on
+	# the values themselves and has to be resolved sequentially.
+	shape = ores.shape
+	ores, trees = ores.flatten(), trees.flatten()
+	cells = np.flatnonzero(ores | trees)
+	is_ore = ores[cells]
+	state = random.get_state()
+	values = random.uniform(size=len(cells) + 2 * is_ore.sum() + 2)
+	coal = (values > kwargs["coal_spawn_thres"]) & kwargs["enable_coal"]
+	iron = (values > kwargs["iron_spawn_thres"]) & kwargs["enable_iron"]
+	diamond = (values > kwargs["diamond_spawn_thres"]) & kwargs["enable_diamond"]
+	used = np.where(coal[:-2], 1, np.where(iron[1:-1], 2, 3)).tolist()
+	counts = np.ones(len(cells), int)
+	extra = 0
+	for index in np.flatnonzero(is_ore).tolist():
+		count = used[index + extra]
+		counts[index] = count
+		extra += count - 1
+	starts = np.arange(len(cells)) + np.cumsum(counts - 1) - (counts - 1)
+	random.set_state(state)
+	random.uniform(size=counts.sum())
+
+	def unflatten(mask):
+		grid = np.zeros(len(ores), bool)
+		grid[cells[mask]] = True
+		return grid.reshape(shape)
+
+	tree = (values[starts] > kwargs["tree_spawn_thres"]) & kwargs["enable_trees"]
+	return (
+			unflatten(is_ore & (counts == 1)),
+			unflatten(is_ore & (counts == 2)),
+			unflatten(is_ore & (counts == 3) & diamond[starts + 2]),
+			unflatten(~is_ore & tree))
+
+
+def _set_objects(world, player, center, tunnels, random, chunk, counted=True, **kwargs):
+	# Spawns the initial mobs of the chunk in row-major cell order. Which cells
+	# can spawn which mob is computed on whole arrays and the mobs are counted
+	# as they spawn, so the cost does not grow with the number of objects. The
+	# caps apply to the mobs of the whole world, or of the chunk if not counted.
 	if not kwargs["enable_mobs"]:
 			return
 
-	num_cows = len([1 for obj in world._objects if isinstance(obj, objects.Cow)])
-	num_zombies = len([1 for obj in world._objects if isinstance(obj, objects.Zombie)])
-	num_skeletons = len([1 for obj in world._objects if isinstance(obj, objects.Skeleton)])
+	xmin, xmax, ymin, ymax = chunk
+	x, y = np.meshgrid(np.arange(xmin, xmax), np.arange(ymin, ymax), indexing='ij')
+	dist = np.sqrt((x - center[0]) ** 2 + (y - center[1]) ** 2)
+	material = world._mat_map[xmin: xmax, ymin: ymax]
+	tunnels = tunnels[xmin: xmax, ymin: ymax]
+	walkable = np.isin(material, [world._mat_ids[name] for name in constants.walkable])
+	cow = walkable & (material == world._mat_ids['grass'])
+	cow &= (dist < kwargs["max_cow_spawn_dist"]) & (dist > kwargs["min_cow_spawn_dist"])
+	zombie = walkable & (dist < kwargs["max_zombie_spawn_dist"])
+	zombie &= dist > max(kwargs["min_zombie_spawn_dist"], 10)
+	skeleton = walkable & (material == world._mat_ids['path']) & tunnels
+	skeleton &= (dist < kwargs["max_skeleton_spawn_dist"]) & (dist > max(kwargs["min_skeleton_spawn_dist"], 10))
 
-	if dist < kwargs["max_cow_spawn_dist"] and dist > kwargs["min_cow_spawn_dist"] and material == 'grass' and uniform() > kwargs["cow_spawn_thres"] and num_cows < kwargs["max_num_cows"]:
-			world.add(objects.Cow(world, (x, y)))
-	elif dist < kwargs["max_zombie_spawn_dist"] and dist > max(kwargs["min_zombie_spawn_dist"], 10) and uniform() > kwargs["zombie_spawn_thres"] and not kwargs["peaceful_mode"] and num_zombies < kwargs["max_num_zombies"]:
-			world.add(objects.Zombie(world, (x, y), player))
-	elif dist < kwargs["max_skeleton_spawn_dist"] and dist > max(kwargs["min_skeleton_spawn_dist"], 10) and material == 'path' and tunnels[x, y] and uniform() > kwargs["skeleton_spawn_thres"] and not kwargs["peaceful_mode"] and num_skeletons < kwargs["max_num_skeletons"]:
-			world.add(objects.Skeleton(world, (x, y), player))
+	num_cows = num_zombies = num_skeletons = 0
+	if counted:
+		num_cows = len([1 for obj in world._objects if isinstance(obj, objects.Cow)])
+		num_zombies = len([1 for obj in world._objects if isinstance(obj, objects.Zombie)])
+		num_skeletons = len([1 for obj in world._objects if isinstance(obj, objects.Skeleton)])
+	mobs = not kwargs["peaceful_mode"]
+
+	# Draw enough numbers for every candidate and afterwards rewind the random
+	# state so that only the numbers that were actually used are consumed.
+	state = random.get_state()
+	values = iter(random.uniform(size=cow.sum() + zombie.sum() + skeleton.sum()).tolist())
+	used = 0
+	cells = np.flatnonzero(cow | zombie | skeleton)
+	candidates = zip(
+			cells.tolist(), cow.flat[cells].tolist(),
+			zombie.flat[cells].tolist(), skeleton.flat[cells].tolist())
+	for cell, can_cow, can_zombie, can_skeleton in candidates:
+			pos = divmod(cell, ymax - ymin)
+			pos = pos[0] + xmin, pos[1] + ymin
+			if can_cow:
+					used += 1
+					if next(values) > kwargs["cow_spawn_thres"] and num_cows < kwargs["max_num_cows"]:
+							world.add(objects.Cow(world, pos))
+							num_cows += 1
+							continue
+			if can_zombie:
+					used += 1
+					if next(values) > kwargs["zombie_spawn_thres"] and mobs and num_zombies < kwargs["max_num_zombies"]:
+							world.add(objects.Zombie(world, pos, player))
+							num_zombies += 1
+							continue
+			if can_skeleton:
+					used += 1
+					if next(values) > kwargs["skeleton_spawn_thres"] and mobs and num_skeletons < kwargs["max_num_skeletons"]:
+							world.add(objects.Skeleton(world, pos, player))
+							num_skeletons += 1
+	random.set_state(state)
+	random.uniform(size=used)
 
 
 def _simplex(simplex, x, y, z, sizes, normalize=True):
@@ -118,3 +402,29 @@ def _simplex(simplex, x, y, z, sizes, normalize=True):
 	if normalize:
 			value /= sum(sizes.values())
 	return value
+
+
+def _simplex_grids(simplex, grids):
+	# Evaluates _simplex() on several grids with a single call into the noise
+	# backend. Each grid is given by the arguments of _simplex(), with vectors
+	# xs and ys instead of x and y, and results in an array of shape
+	# (len(xs), len(ys)).
+	coords = []
+	for xs, ys, z, sizes, *_ in grids:
+			for size in (sizes if isinstance(sizes, dict) else {sizes: 1}):
+					x, y = np.meshgrid(xs / size, ys / size, indexing='ij')
+					coords.append((x.ravel(), y.ravel(), np.full(x.size, z, float)))
+	noises = iter(np.split(
+			simplex.noise3(*(np.concatenate(axis) for axis in zip(*coords))),
+			np.cumsum([len(x) for x, _, _ in coords])[:-1]))
+	values = []
+	for xs, ys, z, sizes, *normalize in grids:
+			if not isinstance(sizes, dict):
+					sizes = {sizes: 1}
+			value = 0
+			for size, weight in sizes.items():
+					value += weight * next(noises).reshape((len(xs), len(ys)))
+			if normalize[0] if normalize else True:
+					value /= sum(sizes.values())
+			values.append(value)
+	return values
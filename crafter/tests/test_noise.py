@@ -0,0 +1,24 @@
+import numpy as np
+import opensimplex
+import pytest
+
+from crafter import noise
+
+
+@pytest.mark.parametrize('seed', [0, 1, 12345, 2 ** 31 - 2])
+def test_noise3_matches_opensimplex(seed):
+  reference = opensimplex.OpenSimplex(seed=seed)
+  points = np.random.RandomState(seed % 1000).uniform(-40, 40, (500, 3))
+  # Points on the lattice and near the region boundaries as well.
+  points = np.concatenate([points, np.round(points * 2) / 2])
+  x, y, z = points.T
+  expected = [reference.noise3(*point) for point in points.tolist()]
+  assert noise.OpenSimplex(seed).noise3(x, y, z).tolist() == expected
+
+
+def test_noise3array_matches_opensimplex():
+  x, y, z = np.arange(20) / 7, np.arange(16) / 5, np.array([0.0, 3.0])
+  reference = opensimplex.OpenSimplex(seed=7)
+  expected = np.array([
+      [[reference.noise3(a, b, c) for a in x] for b in y] for c in z])
+  assert np.array_equal(noise.OpenSimplex(7).noise3array(x, y, z), expected)
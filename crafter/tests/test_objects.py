@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from crafter import constants
+from crafter import engine
+from crafter import objects
+
+
+def test_draws_replay_random_state():
+  random = np.random.RandomState(0)
+  draws = objects._Draws(np.random.RandomState(0), 300)
+  for _ in range(100):
+    value = draws.uniform()
+    assert value == random.uniform()
+    if value < 0.5:
+      assert draws.randint() == random.randint(0, 4)
+
+
+def test_draws_give_back_unused_outputs():
+  random = np.random.RandomState(1)
+  expected = np.random.RandomState(1)
+  draws = objects._Draws(random, 20)
+  for _ in range(3):
+    assert draws.uniform() == expected.uniform()
+  assert draws.randint() == expected.randint(0, 4)
+  draws.finish()
+  assert random.uniform() == expected.uniform()
+  assert random.randint(0, 4) == expected.randint(0, 4)
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2, 3])
+def test_update_objects_matches_sequential(seed):
+  assert _crowd(seed, batch=True) == _crowd(seed, batch=False)
+
+
+def _crowd(seed, batch):
+  # Mobs around a player in a small world, with blocked cells, attacks,
+  # arrows, dead mobs and contested cells.
+  world = engine.World((12, 12), constants.materials, (6, 6))
+  world.reset(seed=seed)
+  world[:, :] = 'grass'
+  world[3:9, 3] = 'stone'
+  world[8, 5:8] = 'water'
+  world[2:5, 8:11] = 'path'
+  player = objects.Player(world, (6, 6))
+  world.add(player)
+  kinds = (objects.Cow, objects.Zombie, objects.Skeleton)
+  cells = np.nonzero(world.random.uniform(size=world.area) < 0.3)
+  for i, pos in enumerate(zip(*cells)):
+    if world[pos][1] is None and world[pos][0] in ('grass', 'path'):
+      cls = kinds[i % 3]
+      world.add(cls(world, pos) if cls is objects.Cow else cls(world, pos, player))
+  states = []
+  for step in range(20):
+    player.health = 9
+    player.sleeping = step % 2 == 0
+    objs = [obj for obj in world.objects if obj is not player]
+    if step % 5 == 4:
+      objs[step % len(objs)].health = 0
+    if step == 7:
+      world.remove(objs[1])
+    if batch:
+      mobs = [obj for obj in objs if type(obj) in objects._MOBS]
+      objects._update_batch(world, player, objs, mobs)
+    else:
+      for obj in objs:
+        obj.update()
+    states.append([
+        (type(obj).__name__, obj.pos.tolist(), obj.health,
+         getattr(obj, 'cooldown', None), getattr(obj, 'reload', None))
+        for obj in world.objects] + [player.health])
+  states.append(str(world.random.get_state()))
+  return states
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+import crafter
+from crafter import constants
+from crafter import engine
+from crafter import objects
+from crafter import worldgen
+
+
+def _generate(seed, vectorized, **kwargs):
+  world = engine.World((64, 64), constants.materials, (12, 12))
+  world.reset(seed=seed)
+  player = objects.Player(world, (32, 32))
+  world.add(player)
+  tunnels = worldgen.generate_world(world, player, vectorized, **kwargs)
+  mobs = [(type(obj).__name__, obj.pos.tolist()) for obj in world.objects]
+  return (
+      world._mat_map.copy(), tunnels, mobs, str(world.random.get_state()))
+
+
+@pytest.mark.parametrize('biome', ['none', 'mountain', 'beaches', 'grassland'])
+@pytest.mark.parametrize('seed', [0, 1])
+def test_vectorized_worldgen_matches_per_cell(biome, seed):
+  kwargs = dict(crafter.Env().world_kwargs, target_biome=biome)
+  expected = _generate(seed, False, **kwargs)
+  actual = _generate(seed, True, **kwargs)
+  assert np.array_equal(actual[0], expected[0])
+  assert np.array_equal(actual[1], expected[1])
+  assert actual[2:] == expected[2:]
+
+
+def test_vectorized_worldgen_matches_per_cell_with_options():
+  kwargs = dict(
+      crafter.Env().world_kwargs, enable_water=False, enable_lava=False,
+      peaceful_mode=True, coal_spawn_thres=0.5, tree_spawn_thres=0.6)
+  expected = _generate(3, False, **kwargs)
+  actual = _generate(3, True, **kwargs)
+  assert np.array_equal(actual[0], expected[0])
+  assert np.array_equal(actual[1], expected[1])
+  assert actual[2:] == expected[2:]
@@ -1,20 +1,37 @@
 import json
+import os
 import numpy as np
 from functools import partial
 
+from stable_baselines3.common.vec_env.base_vec_env import VecEnv
 from stable_baselines3.common.vec_env.subproc_vec_env import SubprocVecEnv
 from stable_baselines3.common.vec_env.vec_monitor import VecMonitor
 
 from crafter.env import Env
+from crafter.vector import BatchEnv
 
 class EnvLoader():
 
-    def __init__(self, config_path, num_repeats, **kwargs):
-        self.config_path = config_path
+    # transport="pipe" runs every env in its own SubprocVecEnv worker.
+    # transport="shared_memory" runs them in a few crafter workers that write
+    # observations, rewards, dones and the info_keys fields into shared memory.
+    # These workers are started once and keep running across samples and
+    # calls to load(), which only replace the envs inside of them.
+    def __init__(self, config_path, num_repeats, transport="pipe", processes=None,
+                 info_keys=("inventory", "achievements", "discount", "player_pos", "reward"), **kwargs):
         self.num_repeats = num_repeats
+        self.transport = transport
+        self.processes = processes or os.cpu_count()
+        self.info_keys = info_keys
+        self.pool = None
 
         self.kwargs = kwargs
 
+        self.load(config_path)
+
+
+    def load(self, config_path):
+        self.config_path = config_path
         self.params = []
         
         with open(f"{config_path}", "r") as f:
@@ -57,6 +74,25 @@ class EnvLoader():
             
                 params.append(x)
 
+        if self.transport == "shared_memory":
+            configs = [ dict(length=1024,
+                             seed=param["seed"],
+                             world_kwargs=param["world_kwargs"],
+                             initial_inventory=param["initial_inventory"],
+                             **self.kwargs
+                        )
+                        for param in params
+                    ]
+
+            if self.pool is None or self.pool.closed:
+                self.pool = SharedMemoryVecEnv(configs, self.processes, self.info_keys)
+            else:
+                self.pool.configure(configs)
+
+            venv = VecMonitor(self.pool)
+
+            return venv, len(params)
+
         env_fns = [ partial(Env,
                             length=1024, 
                             seed=param["seed"],
@@ -71,3 +107,53 @@ class EnvLoader():
         venv = VecMonitor(venv)
 
         return venv, len(params)
+
+
+class SharedMemoryVecEnv(VecEnv):
+
+    # A stable-baselines3 vector env on top of crafter's BatchEnv. The images
+    # are a ring of two slots, so the previous observation that the agent
+    # keeps is not overwritten by the next step.
+    def __init__(self, configs, processes, info_keys):
+        self.batch = BatchEnv(configs, processes, info_keys=info_keys, ring=2)
+        self.closed = False
+        super().__init__(len(configs), self.batch.observation_space, self.batch.action_space)
+
+    # Replaces the envs in the running workers, which takes about as long as
+    # generating their worlds on reset.
+    def configure(self, configs):
+        self.batch.configure(configs)
+        self.num_envs = len(configs)
+        self.observation_space = self.batch.observation_space
+
+    def reset(self):
+        return self.batch.reset()
+
+    def step_async(self, actions):
+        self.batch.step_async(actions)
+
+    def step_wait(self):
+        return self.batch.step_wait()
+
+    def close(self):
+        self.batch.close()
+        self.closed = True
+
+    def get_attr(self, attr_name, indices=None):
+        return self.batch.call("__getattribute__", attr_name, indices=self._get_indices(indices))
+
+    def set_attr(self, attr_name, value, indices=None):
+        self.batch.call("__setattr__", attr_name, value, indices=self._get_indices(indices))
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return self.batch.call(method_name, *method_args, indices=self._get_indices(indices), **method_kwargs)
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False for _ in self._get_indices(indices)]
+
+    def seed(self, seed=None):
+        # The envs are seeded when they are created.
+        return [None for _ in range(self.num_envs)]
+
+    def get_images(self):
+        return self.batch.call("render", "rgb_array")
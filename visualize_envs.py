@@ -29,6 +29,13 @@ def main(args):
         frame = images[i]
         imageio.imsave(f"{args.save_path}/env_{i}.png", frame)
 
+    # The whole world of every env, with map_unit pixels per cell, if asked for.
+    if args.map_unit > 0:
+        maps = venv.env_method("render_world", args.map_unit)
+
+        for i in range(len(maps)):
+            imageio.imsave(f"{args.save_path}/env_{i}_world.png", maps[i])
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -36,6 +43,7 @@ if __name__ == "__main__":
     parser.add_argument("--num_repeats", type=int, default=1)
     parser.add_argument("--config_path", type=str, required=True)
     parser.add_argument("--save_path", type=str, default="./environment_visualizations/")
+    parser.add_argument("--map_unit", type=int, default=0)
 
     args = parser.parse_args()
 